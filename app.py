@@ -4,17 +4,76 @@ from dash import dcc, html, Input, Output, State
 import dash_bootstrap_components as dbc
 import base64
 from datetime import datetime
-from flask import Flask
+from flask import Flask, Response, abort, jsonify, request
+from werkzeug.utils import safe_join
 from utils.video_processor import VideoProcessor
 from components.layout import create_layout
 from components.callbacks import register_callbacks
 from components.admin import create_admin_layout
 from components.admin_callbacks import register_admin_callbacks
+from utils.enhance_cache import enhanced_crop
+from utils.uploads import UploadError, VIDEO_EXTENSIONS, get_uploads
+from utils.streaming import send_video
 
 # Initialize Flask server
 server = Flask(__name__)
 server.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
 
+@server.route('/enhanced/<batch>/<filename>')
+def serve_enhanced(batch, filename):
+    """Serve the enhanced variant of an extracted crop, enhancing it on first request"""
+    crop_path = safe_join('extracted', batch, filename)
+    if crop_path is None or not filename.endswith('.jpg') or not os.path.isfile(crop_path):
+        abort(404)
+    
+    response = Response(enhanced_crop(crop_path), mimetype='image/jpeg')
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    if request.args.get('download'):
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@server.route('/videos/<filename>')
+def serve_video(filename):
+    """Stream an uploaded video to the player, in byte ranges as it seeks"""
+    video_path = safe_join('uploads', filename)
+    if video_path is None or not filename.lower().endswith(VIDEO_EXTENSIONS) or not os.path.isfile(video_path):
+        abort(404)
+    return send_video(video_path)
+
+def upload_error(e):
+    response = jsonify(error=str(e), offset=e.offset)
+    response.status_code = e.status
+    return response
+
+@server.route('/upload', methods=['POST'])
+def create_upload():
+    """Start a resumable upload announced as {filename, size[, sha256]}"""
+    spec = request.get_json(silent=True) or {}
+    try:
+        return jsonify(get_uploads().create(spec.get('filename'), spec.get('size'), spec.get('sha256'))), 201
+    except UploadError as e:
+        return upload_error(e)
+
+@server.route('/upload/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Offset an interrupted upload continues from"""
+    try:
+        return jsonify(get_uploads().status(upload_id))
+    except UploadError as e:
+        return upload_error(e)
+
+@server.route('/upload/<upload_id>', methods=['PATCH'])
+def upload_chunk(upload_id):
+    """Append the request body at the offset given in Upload-Offset; the
+    body is streamed to disk, never read into memory whole"""
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        return upload_error(UploadError("Upload-Offset header is required"))
+    try:
+        return jsonify(get_uploads().append(upload_id, offset, request.stream, request.content_length))
+    except UploadError as e:
+        return upload_error(e)
+
 # Initialize the main Dash app
 app = dash.Dash(
     __name__,
@@ -0,0 +1,146 @@
+/*
+ * Chunked, resumable video uploads to the /upload endpoints of app.py.
+ *
+ * Clicking or dropping a file on #upload-video sends it in CHUNK_SIZE
+ * slices; the browser never reads the whole file into memory. The upload
+ * ID is remembered per file, so picking the same file again after a
+ * dropped connection or a reload continues from the offset the server
+ * reports. The upload-poll interval hands the finished upload to Dash
+ * through the uploads.poll clientside callback.
+ */
+(function () {
+    var CHUNK_SIZE = 8 * 1024 * 1024;
+    var MAX_RETRIES = 5;
+
+    var state = window.chunkedUpload = {status: '', result: null, busy: false};
+
+    function fileKey(file) {
+        return 'upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+    }
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    function formatBytes(bytes) {
+        var units = ['B', 'KB', 'MB', 'GB'];
+        var i = 0;
+        while (bytes >= 1024 && i < units.length - 1) {
+            bytes /= 1024;
+            i++;
+        }
+        return bytes.toFixed(i ? 1 : 0) + ' ' + units[i];
+    }
+
+    async function request(method, url, body, headers) {
+        var response = await fetch(url, {method: method, body: body, headers: headers || {}});
+        var data = await response.json().catch(function () { return {}; });
+        return {status: response.status, ok: response.ok, data: data};
+    }
+
+    async function resumeOrCreate(file) {
+        var uploadId = localStorage.getItem(fileKey(file));
+        if (uploadId) {
+            var existing = await request('GET', '/upload/' + uploadId);
+            if (existing.ok) {
+                return existing.data;
+            }
+        }
+        var created = await request('POST', '/upload', JSON.stringify({filename: file.name, size: file.size}),
+                                    {'Content-Type': 'application/json'});
+        if (!created.ok) {
+            throw new Error(created.data.error || 'Upload refused');
+        }
+        localStorage.setItem(fileKey(file), created.data.upload_id);
+        return created.data;
+    }
+
+    async function upload(file) {
+        state.busy = true;
+        state.result = null;
+        state.status = 'Uploading ' + file.name + '...';
+        try {
+            var upload = await resumeOrCreate(file);
+            var retries = 0;
+            while (!upload.complete) {
+                var offset = upload.offset;
+                state.status = 'Uploading ' + file.name + ': ' + formatBytes(offset) + ' of ' +
+                    formatBytes(file.size) + ' (' + Math.floor(100 * offset / file.size) + '%)';
+                var chunk;
+                try {
+                    chunk = await request('PATCH', '/upload/' + upload.upload_id,
+                                          file.slice(offset, offset + CHUNK_SIZE),
+                                          {'Upload-Offset': String(offset),
+                                           'Content-Type': 'application/offset+octet-stream'});
+                } catch (e) {
+                    chunk = {status: 0, ok: false, data: {}};
+                }
+                if (chunk.ok) {
+                    upload = chunk.data;
+                    retries = 0;
+                } else if (chunk.status === 409 && chunk.data.offset < file.size) {
+                    // The server has more or less than we thought; continue from its offset
+                    upload.offset = chunk.data.offset;
+                } else if (chunk.status === 409) {
+                    // An earlier chunk whose answer was lost completed the upload
+                    upload = (await request('GET', '/upload/' + upload.upload_id)).data;
+                } else if ((chunk.status === 0 || chunk.status >= 500) && retries < MAX_RETRIES) {
+                    retries++;
+                    await sleep(1000 * Math.pow(2, retries));
+                    upload = (await request('GET', '/upload/' + upload.upload_id)).data;
+                } else {
+                    throw new Error(chunk.data.error || 'Upload failed');
+                }
+            }
+            localStorage.removeItem(fileKey(file));
+            state.status = 'Uploaded ' + file.name + ' (' + formatBytes(file.size) + ')';
+            state.result = {upload_id: upload.upload_id, filename: upload.filename, sha256: upload.sha256};
+        } catch (e) {
+            state.status = 'Upload failed: ' + e.message + '. Pick the file again to resume.';
+        } finally {
+            state.busy = false;
+        }
+    }
+
+    function pick() {
+        var input = document.createElement('input');
+        input.type = 'file';
+        input.accept = 'video/*';
+        input.onchange = function () {
+            if (input.files.length) {
+                upload(input.files[0]);
+            }
+        };
+        input.click();
+    }
+
+    document.addEventListener('click', function (event) {
+        if (event.target.closest('#upload-video') && !state.busy) {
+            pick();
+        }
+    });
+    document.addEventListener('dragover', function (event) {
+        if (event.target.closest('#upload-video')) {
+            event.preventDefault();
+        }
+    });
+    document.addEventListener('drop', function (event) {
+        if (event.target.closest('#upload-video')) {
+            event.preventDefault();
+            if (!state.busy && event.dataTransfer.files.length) {
+                upload(event.dataTransfer.files[0]);
+            }
+        }
+    });
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        uploads: {
+            // Upload status line, and the finished upload once it is new
+            poll: function (n_intervals, current) {
+                var result = state.result;
+                var changed = result && (!current || current.upload_id !== result.upload_id);
+                return [state.status, changed ? result : window.dash_clientside.no_update];
+            }
+        }
+    });
+})();
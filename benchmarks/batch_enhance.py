@@ -0,0 +1,49 @@
+"""Re-enhance every crop under a directory and compare worker counts.
+
+Usage: python benchmarks/batch_enhance.py [ROOT] [WORKERS ...]
+
+ROOT defaults to extracted/. Enhanced copies are written next to the
+crops with an _enhanced suffix, as ImageEnhancer.enhance_image does.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.image_enhancer import ImageEnhancer, ENHANCE_CORES
+
+
+def find_crops(root):
+    return sorted(
+        os.path.join(dirpath, name)
+        for dirpath, _, filenames in os.walk(root)
+        for name in filenames
+        if name.endswith('.jpg') and not name.endswith('_enhanced.jpg')
+    )
+
+
+def main():
+    root = sys.argv[1] if len(sys.argv) > 1 else 'extracted'
+    worker_counts = [int(w) for w in sys.argv[2:]] or sorted({1, ENHANCE_CORES})
+    paths = find_crops(root)
+    if not paths:
+        print(f"No crops found under {root}")
+        sys.exit(1)
+
+    enhancer = ImageEnhancer()
+    print(f"{len(paths)} crops under {root}")
+    print(f"{'workers':>8} {'seconds':>10} {'images/s':>10} {'errors':>8} {'p50 ms':>8} {'max ms':>8}")
+    for workers in worker_counts:
+        start = time.perf_counter()
+        records = enhancer.batch_enhance(paths, workers=workers)
+        elapsed = time.perf_counter() - start
+        errors = sum(1 for record in records if record['error'])
+        times = sorted(record['seconds'] for record in records if record['seconds'] is not None)
+        p50 = 1000 * times[len(times) // 2] if times else 0.0
+        slowest = 1000 * times[-1] if times else 0.0
+        print(f"{workers:>8} {elapsed:>10.2f} {len(paths) / elapsed:>10.1f} {errors:>8} {p50:>8.1f} {slowest:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Compare packed batch enhancement with enhancing crops one by one.
+
+Usage: python benchmarks/crop_batch.py [BATCH_SIZE]
+
+Synthetic crops of several sizes run through ImageEnhancer.enhance_arrays
+with its batched methods (color, sharpen, hdr), once packed into a
+CropBatch and once per crop, and the milliseconds per crop are printed.
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils.crop_batch
+from utils.image_enhancer import ImageEnhancer
+
+METHODS = ['color', 'sharpen', 'hdr']
+SIZES = [(16, 32), (32, 64), (64, 128), (120, 240)]
+
+
+def synthetic_crop(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    base = cv2.resize(rng.integers(0, 256, (12, 8, 3), dtype=np.uint8), (width, height),
+                      interpolation=cv2.INTER_CUBIC)
+    noisy = base.astype(np.float32) + rng.normal(0, 8, base.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def ms_per_crop(enhancer, images, max_pixels, repeats=5):
+    utils.crop_batch.SMALL_CROP_PIXELS = max_pixels
+    enhancer.enhance_arrays(images, METHODS)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        enhancer.enhance_arrays(images, METHODS)
+    return 1000 * (time.perf_counter() - start) / repeats / len(images)
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    enhancer = ImageEnhancer()
+    threshold = utils.crop_batch.SMALL_CROP_PIXELS
+
+    print(f"{'crop':>10} {'batched':>10} {'per crop':>10}   (ms/crop, {batch_size} crops)")
+    for w, h in SIZES:
+        images = [synthetic_crop(w, h, seed) for seed in range(batch_size)]
+        # An unlimited threshold packs every crop, zero packs none
+        batched = ms_per_crop(enhancer, images, max_pixels=w * h)
+        single = ms_per_crop(enhancer, images, max_pixels=0)
+        marker = '' if w * h <= threshold else '   (above SMALL_CROP_PIXELS)'
+        print(f"{f'{w}x{h}':>10} {batched:>10.2f} {single:>10.2f}{marker}")
+    utils.crop_batch.SMALL_CROP_PIXELS = threshold
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Print the cost of every denoise tier in milliseconds per megapixel.
+
+Usage: python benchmarks/denoise_tiers.py [IMAGE ...]
+
+Without images, synthetic noisy crops of typical sizes are used.
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.denoise import denoise
+
+TIERS = ['off', 'fast', 'balanced', 'quality']
+SIZES = [(160, 320), (320, 640), (540, 1080)]
+
+
+def synthetic_crop(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    base = cv2.resize(rng.integers(0, 256, (12, 8, 3), dtype=np.uint8), (width, height),
+                      interpolation=cv2.INTER_CUBIC)
+    noisy = base.astype(np.float32) + rng.normal(0, 10, base.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def ms_per_megapixel(image, tier, repeats=3):
+    denoise(image, tier)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        denoise(image, tier)
+    elapsed = (time.perf_counter() - start) / repeats
+    return 1000 * elapsed / (image.shape[0] * image.shape[1] / 1e6)
+
+
+def main():
+    if len(sys.argv) > 1:
+        images = [(os.path.basename(path), cv2.imread(path)) for path in sys.argv[1:]]
+    else:
+        images = [(f"{w}x{h}", synthetic_crop(w, h)) for w, h in SIZES]
+
+    print(f"{'image':>12} " + " ".join(f"{tier:>10}" for tier in TIERS) + "   (ms/MP)")
+    for name, image in images:
+        row = [ms_per_megapixel(image, tier) for tier in TIERS]
+        print(f"{name:>12} " + " ".join(f"{value:>10.1f}" for value in row))
+
+
+if __name__ == '__main__':
+    main()
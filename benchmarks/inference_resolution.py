@@ -0,0 +1,72 @@
+"""Measure pose detection latency and bounding box drift when detection runs
+on a downscaled copy of each frame instead of the full-resolution frame.
+
+Usage: python benchmarks/inference_resolution.py VIDEO [MAX_SIDE ...]
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.frame_sampler import FrameSampler
+from utils.tracker import box_iou
+from utils.video_processor import VideoProcessor
+
+
+def load_frames(video_path, frame_rate=10, limit=100):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        frames = []
+        for _, frame in FrameSampler(cap, frame_rate, strategy='grab'):
+            frames.append(frame)
+            if len(frames) >= limit:
+                break
+        return frames
+    finally:
+        cap.release()
+
+
+def detect_all(frames, max_side):
+    """Return per-frame latency in ms and the bounding boxes (None when missed)"""
+    processor = VideoProcessor()
+    processor.warm_up()
+    timings, boxes = [], []
+    for index, frame in enumerate(frames):
+        start = time.perf_counter()
+        detection = processor._detect_person(frame, index, 0.0, max_side)
+        timings.append(1000 * (time.perf_counter() - start))
+        boxes.append(None if detection is None else detection[1])
+    processor.close()
+    return timings, boxes
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    frames = load_frames(sys.argv[1])
+    sizes = [int(size) for size in sys.argv[2:]] or [1280, 960, 640, 480]
+    h, w = frames[0].shape[:2]
+    print(f"{len(frames)} frames at {w}x{h}")
+
+    full_timings, full_boxes = detect_all(frames, None)
+    print(f"{'max side':>9} {'ms/frame':>9} {'speedup':>8} {'mean IoU':>9} {'max drift px':>13} {'agree':>6}")
+    print(f"{'full':>9} {np.mean(full_timings):>9.1f} {1.0:>8.2f} {1.0:>9.3f} {0:>13} {1.0:>6.2f}")
+
+    for max_side in sizes:
+        timings, boxes = detect_all(frames, max_side)
+        pairs = [(a, b) for a, b in zip(full_boxes, boxes) if a is not None and b is not None]
+        agree = sum((a is None) == (b is None) for a, b in zip(full_boxes, boxes)) / len(frames)
+        mean_iou = np.mean([box_iou(a, b) for a, b in pairs]) if pairs else float('nan')
+        drift = max((max(abs(p - q) for p, q in zip(a, b)) for a, b in pairs), default=0)
+        print(f"{max_side:>9} {np.mean(timings):>9.1f} {np.mean(full_timings) / np.mean(timings):>8.2f} "
+              f"{mean_iou:>9.3f} {drift:>13} {agree:>6.2f}")
+
+
+if __name__ == '__main__':
+    main()
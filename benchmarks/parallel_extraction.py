@@ -0,0 +1,41 @@
+"""Compare wall-clock time of serial and segment-parallel extraction.
+
+Usage: python benchmarks/parallel_extraction.py VIDEO [WORKERS ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.video_processor import VideoProcessor
+
+
+def run(video_path, workers, frame_rate=10, segment_seconds=60):
+    processor = VideoProcessor()
+    start = time.time()
+    images = processor.process_video(video_path, frame_rate, workers=workers,
+                                     segment_seconds=segment_seconds)
+    return time.time() - start, len(images)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    video_path = sys.argv[1]
+    worker_counts = [int(w) for w in sys.argv[2:]] or [2, 4, os.cpu_count() or 1]
+
+    serial_time, serial_count = run(video_path, 1)
+    print(f"{'workers':>8} {'seconds':>10} {'crops':>8} {'speedup':>8}")
+    print(f"{1:>8} {serial_time:>10.2f} {serial_count:>8} {1.0:>8.2f}")
+    for workers in worker_counts:
+        # Batch directories are named per second, keep runs apart
+        time.sleep(1)
+        elapsed, count = run(video_path, workers)
+        print(f"{workers:>8} {elapsed:>10.2f} {count:>8} {serial_time / elapsed:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
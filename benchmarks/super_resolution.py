@@ -0,0 +1,46 @@
+"""Measure super-resolution throughput in output megapixels per second.
+
+Usage: python benchmarks/super_resolution.py [ENGINE ...]
+
+Runs every engine (all registered ones by default) on synthetic crops one
+at a time and as a single batch. SR_THREADS, SR_TILE and SR_TILE_BATCH
+tune the 'espcn' engine.
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.super_resolution import ENGINES, get_engine
+
+SIZES = [(160, 320), (320, 640), (540, 1080)]
+CROPS_PER_SIZE = 4
+
+
+def main():
+    names = sys.argv[1:] or list(ENGINES)
+    rng = np.random.default_rng(0)
+    crops = [rng.integers(0, 256, (h, w, 3), dtype=np.uint8) for w, h in SIZES for _ in range(CROPS_PER_SIZE)]
+    megapixels = sum(c.shape[0] * c.shape[1] * 4 for c in crops) / 1e6
+
+    print(f"{len(crops)} crops, {megapixels:.1f} output megapixels per pass")
+    print(f"{'engine':>10} {'single MP/s':>12} {'batch MP/s':>12}")
+    for name in names:
+        engine = get_engine(name)
+        engine.upscale(crops[0])  # warm up
+
+        engine.megapixels = engine.seconds = 0.0
+        for crop in crops:
+            engine.upscale(crop)
+        single = engine.stats()['mp_per_s']
+
+        engine.megapixels = engine.seconds = 0.0
+        engine.upscale_batch(crops)
+        batch = engine.stats()['mp_per_s']
+        print(f"{engine.name:>10} {single:>12.2f} {batch:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Measure pose detection latency per sampled frame with and without person
+tracking, which runs detection on the region of interest around the
+tracked person's landmarks instead of the full frame.
+
+Usage: python benchmarks/tracking_roi.py VIDEO [FRAME_RATE]
+"""
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.frame_sampler import FrameSampler
+from utils.tracker import PersonTracker, box_iou
+from utils.video_processor import VideoProcessor
+
+
+def load_frames(video_path, frame_rate, limit=200):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        frames = []
+        for _, frame in FrameSampler(cap, frame_rate, strategy='grab'):
+            frames.append(frame)
+            if len(frames) >= limit:
+                break
+        return frames
+    finally:
+        cap.release()
+
+
+def detect_all(frames, tracking):
+    """Return per-frame latency in ms, the crop boxes (None when missed),
+    the share of the frame each detection looked at and the tracker"""
+    processor = VideoProcessor()
+    processor.warm_up()
+    tracker = PersonTracker() if tracking else None
+    options = {'confidence_threshold': 0.5, 'inference_max_side': None}
+    h, w = frames[0].shape[:2]
+    timings, boxes, shares = [], [], []
+    for index, frame in enumerate(frames):
+        roi = tracker.roi(frame.shape) if tracker is not None else None
+        start = time.perf_counter()
+        detection, _ = processor._track_person(frame, index, options, tracker)
+        timings.append(1000 * (time.perf_counter() - start))
+        boxes.append(None if detection is None else detection[1])
+        shares.append(1.0 if roi is None else (roi[2] - roi[0]) * (roi[3] - roi[1]) / float(w * h))
+    processor.close()
+    return timings, boxes, shares, tracker
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    frame_rate = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    frames = load_frames(sys.argv[1], frame_rate)
+    h, w = frames[0].shape[:2]
+    print(f"{len(frames)} frames at {w}x{h}, every {frame_rate} frame(s)")
+
+    full_timings, full_boxes, _, _ = detect_all(frames, False)
+    timings, boxes, shares, tracker = detect_all(frames, True)
+    pairs = [(a, b) for a, b in zip(full_boxes, boxes) if a is not None and b is not None]
+    agree = sum((a is None) == (b is None) for a, b in zip(full_boxes, boxes)) / len(frames)
+    mean_iou = np.mean([box_iou(a, b) for a, b in pairs]) if pairs else float('nan')
+
+    print(f"{'mode':>9} {'ms/frame':>9} {'median':>7} {'speedup':>8} {'frame share':>12} {'mean IoU':>9} {'agree':>6}")
+    print(f"{'full':>9} {np.mean(full_timings):>9.1f} {np.median(full_timings):>7.1f} {1.0:>8.2f} "
+          f"{1.0:>12.2f} {1.0:>9.3f} {1.0:>6.2f}")
+    print(f"{'tracking':>9} {np.mean(timings):>9.1f} {np.median(timings):>7.1f} "
+          f"{np.mean(full_timings) / np.mean(timings):>8.2f} {np.mean(shares):>12.2f} {mean_iou:>9.3f} {agree:>6.2f}")
+    print(f"tracker: {tracker.stats()}")
+
+
+if __name__ == '__main__':
+    main()
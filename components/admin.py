@@ -94,6 +94,56 @@ def create_processing_stats():
         ])
     ])
 
+def create_cache_stats():
+    return dbc.Card([
+        dbc.CardHeader("Enhancement Cache"),
+        dbc.CardBody([
+            dbc.Row([
+                dbc.Col([
+                    html.H4("Hits"),
+                    html.H2(id="cache-hits", children="0")
+                ], width=3),
+                dbc.Col([
+                    html.H4("Misses"),
+                    html.H2(id="cache-misses", children="0")
+                ], width=3),
+                dbc.Col([
+                    html.H4("Evictions"),
+                    html.H2(id="cache-evictions", children="0")
+                ], width=3),
+                dbc.Col([
+                    html.H4("Size"),
+                    html.H2(id="cache-size", children="0 MB")
+                ], width=3),
+            ])
+        ])
+    ])
+
+def create_job_queue_stats():
+    return dbc.Card([
+        dbc.CardHeader("Job Queue"),
+        dbc.CardBody([
+            dbc.Row([
+                dbc.Col([
+                    html.H4("Queued"),
+                    html.H2(id="jobs-queued", children="0")
+                ], width=3),
+                dbc.Col([
+                    html.H4("Running"),
+                    html.H2(id="jobs-running", children="0")
+                ], width=3),
+                dbc.Col([
+                    html.H4("Wait p50 / p90 / p99"),
+                    html.H2(id="jobs-wait", children="-")
+                ], width=4),
+                dbc.Col([
+                    html.H4("Rejected"),
+                    html.H2(id="jobs-rejected", children="0")
+                ], width=2),
+            ])
+        ])
+    ])
+
 def create_user_management():
     return dbc.Card([
         dbc.CardHeader("User Management"),
@@ -158,6 +208,16 @@ def create_admin_layout():
         create_processing_stats(),
         html.Hr(),
         
+        # Enhancement cache
+        html.H3("Enhancement Cache", className="mb-3"),
+        create_cache_stats(),
+        html.Hr(),
+        
+        # Extraction job queue
+        html.H3("Job Queue", className="mb-3"),
+        create_job_queue_stats(),
+        html.Hr(),
+        
         # User Management
         html.H3("User Management", className="mb-3"),
         create_user_management(),
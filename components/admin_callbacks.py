@@ -4,6 +4,8 @@ from dash import html
 import psutil
 import plotly.graph_objs as go
 from datetime import datetime, timedelta
+from utils.enhance_cache import get_cache
+from utils.jobs import get_backend
 
 def register_admin_callbacks(app):
     @app.callback(
@@ -108,3 +110,36 @@ def register_admin_callbacks(app):
         avg_time = "2.5s"  # Placeholder
         
         return str(total_videos), str(total_images), avg_time
+
+    @app.callback(
+        [Output("cache-hits", "children"),
+         Output("cache-misses", "children"),
+         Output("cache-evictions", "children"),
+         Output("cache-size", "children")],
+        [Input("stats-update", "n_intervals")]
+    )
+    def update_cache_stats(n_intervals):
+        stats = get_cache().stats()
+        hit_rate = f" ({stats['hit_rate'] * 100:.0f}%)" if stats['hit_rate'] is not None else ""
+        size = f"{stats['bytes'] / 2**20:.1f} / {stats['max_bytes'] / 2**20:.0f} MB"
+        
+        return f"{stats['hits']}{hit_rate}", str(stats['misses']), str(stats['evictions']), size
+
+    @app.callback(
+        [Output("jobs-queued", "children"),
+         Output("jobs-running", "children"),
+         Output("jobs-wait", "children"),
+         Output("jobs-rejected", "children")],
+        [Input("stats-update", "n_intervals")]
+    )
+    def update_job_queue_stats(n_intervals):
+        stats = get_backend().stats()
+        
+        def seconds(value):
+            return "-" if value is None else f"{value:.0f}s"
+        
+        queued = "-" if stats['queued'] is None else str(stats['queued'])
+        running = "-" if stats['running'] is None else str(stats['running'])
+        wait = " / ".join(seconds(stats[key]) for key in ('wait_p50', 'wait_p90', 'wait_p99'))
+        
+        return queued, f"{running} / {stats['capacity']}", wait, str(stats['rejected'])
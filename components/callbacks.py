@@ -1,13 +1,17 @@
 import os
-import base64
 import json
+from urllib.parse import quote
 import logging
 from datetime import datetime
-from dash import Input, Output, State, ctx, no_update
+from dash import Input, Output, State, Patch, ClientsideFunction, ALL, ctx, no_update
 import dash_bootstrap_components as dbc
 from dash import html
-import tempfile
-from utils.video_processor import VideoProcessor
+from flask import request
+from utils.jobs import get_backend, QUEUED, RUNNING, FAILED, CANCELLED
+from utils.scheduler import QueueFull, user_priority
+from utils.auth import verify_token
+from utils.progress import get_store
+from utils.uploads import get_uploads
 from components.pages import (
     create_home_page,
     create_gallery_page,
@@ -18,6 +22,80 @@ from components.pages import (
 
 logger = logging.getLogger(__name__)
 
+def create_gallery_items(extracted_images):
+    """Gallery cards for the records of freshly extracted crops"""
+    gallery_items = []
+    
+    for i, img_data in enumerate(extracted_images):
+        img_url = f"/enhanced/{img_data['timestamp']}/{os.path.basename(img_data['path'])}"
+        gallery_items.append(
+            dbc.Col([
+                dbc.Card([
+                    # Image container with hover effect
+                    html.Div([
+                        dbc.CardImg(
+                            src=img_url,
+                            style={
+                                'height': '350px',
+                                'objectFit': 'cover',
+                            },
+                            className='img-hover'
+                        ),
+                        # Download button overlay
+                        html.A(
+                            dbc.Button(
+                                html.I(className="fas fa-download"),
+                                color="light",
+                                size="sm",
+                                className="download-btn"
+                            ),
+                            href=f'{img_url}?download=1',
+                            download=f'frame_{img_data["frame"]}.jpg',
+                            className="download-overlay"
+                        )
+                    ], className="image-container"),
+                    
+                    # Card body with blog-style content
+                    dbc.CardBody([
+                        html.Div([
+                            # Title and metadata
+                            html.H5(f"Extracted Frame {img_data['frame']}", className="frame-title"),
+                            html.Div([
+                                html.Span([
+                                    html.I(className="far fa-calendar-alt me-2"),
+                                    datetime.strptime(img_data['timestamp'], "%Y%m%d_%H%M%S").strftime("%B %d, %Y")
+                                ], className="me-3"),
+                                html.Span([
+                                    html.I(className="fas fa-camera me-2"),
+                                    "AI Extracted"
+                                ])
+                            ], className="frame-metadata"),
+                            
+                            # Tags
+                            html.Div([
+                                dbc.Badge("Human", color="primary", className="me-2"),
+                                dbc.Badge("Extracted", color="success", className="me-2"),
+                                dbc.Badge(f"Frame {img_data['frame']}", color="info")
+                            ], className="mt-3")
+                        ], className="frame-info")
+                    ], className="p-3")
+                ], className="frame-card")
+            ], xs=12, sm=6, lg=4, className="mb-4")
+        )
+    
+    return gallery_items
+
+def format_progress(progress):
+    """Status line for a running extraction's progress snapshot"""
+    text = f"Analyzed {progress['analyzed_frames']} frames"
+    if progress['total_frames']:
+        text += f" ({progress['decoded_frames']}/{progress['total_frames']} decoded, {progress['fps']:.0f} fps)"
+    text += f", {progress['crops']} crops"
+    if progress['eta'] is not None:
+        minutes, seconds = divmod(int(progress['eta']), 60)
+        text += f", about {minutes}:{seconds:02d} left"
+    return text
+
 def register_callbacks(app):
     # Theme switching callback
     @app.callback(
@@ -80,149 +158,176 @@ def register_callbacks(app):
         else:
             return create_home_page(), "true", "false", "false", "false", "false"
     
+    # Uploads run in the browser; hand the finished one to Dash
+    app.clientside_callback(
+        ClientsideFunction(namespace='uploads', function_name='poll'),
+        [Output('upload-status', 'children'),
+         Output('upload-store', 'data')],
+        Input('upload-poll', 'n_intervals'),
+        State('upload-store', 'data')
+    )
+    
     # Video processing callback
     @app.callback(
         [Output('processing-status', 'children'),
          Output('processing-progress', 'value'),
          Output('gallery-grid', 'children'),
-         Output('process-button', 'disabled')],
+         Output('process-button', 'disabled'),
+         Output('job-store', 'data'),
+         Output('job-poll', 'disabled')],
         [Input('process-button', 'n_clicks'),
-         Input('upload-video', 'contents')],
+         Input('upload-store', 'data'),
+         Input('job-poll', 'n_intervals'),
+         Input('cancel-button', 'n_clicks')],
         [State('frame-rate-slider', 'value'),
-         State('confidence-slider', 'value')],
+         State('confidence-slider', 'value'),
+         State('job-store', 'data')],
         prevent_initial_call=True
     )
-    def process_video_callback(n_clicks, contents, frame_rate, confidence):
+    def process_video_callback(n_clicks, upload, n_intervals, cancel_clicks, frame_rate, confidence, job):
+        # Report on the running extraction job
+        if ctx.triggered_id == 'job-poll':
+            return poll_job(job)
+        
+        # Stop it; polling reports once it has
+        if ctx.triggered_id == 'cancel-button':
+            if job and get_backend().cancel(job['job_id']):
+                return 'Cancelling...', no_update, no_update, True, no_update, no_update
+            return no_update, no_update, no_update, no_update, no_update, no_update
+        
         # Handle file upload state
-        if contents is None:
-            return 'Upload a video to begin', 0, [], True
+        if upload is None:
+            return 'Upload a video to begin', 0, [], True, no_update, no_update
         
-        # If upload-video triggered the callback, just enable the button
-        if ctx.triggered_id == 'upload-video':
-            return 'Ready to process', 0, [], False
+        # If a finished upload triggered the callback, just enable the button
+        if ctx.triggered_id == 'upload-store':
+            return 'Ready to process', 0, [], False, no_update, no_update
         
         # If neither button was clicked nor file uploaded
         if n_clicks is None:
-            return no_update, no_update, no_update, no_update
+            return no_update, no_update, no_update, no_update, no_update, no_update
         
         try:
-            logger.info("Starting video processing")
-            
-            # Decode video content
-            content_type, content_string = contents.split(',')
-            decoded = base64.b64decode(content_string)
+            logger.info("Queueing video processing")
             
-            # Save to temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
-                tmp_file.write(decoded)
-                temp_path = tmp_file.name
-                logger.info(f"Saved uploaded video to temporary file: {temp_path}")
+            # The upload is already in uploads/; resolve it here rather than
+            # trusting a path from the browser
+            video_path = get_uploads().path(upload['upload_id'])
+            if video_path is None or not os.path.exists(video_path):
+                return 'Uploaded video not found, upload it again', 0, [], True, None, True
             
+            # Extraction runs in the background, see utils.jobs, scheduled
+            # fairly between users; only raw crops are stored, the gallery
+            # requests enhanced variants on view
+            token = request.cookies.get('token')
+            user_id = verify_token(token) if token else None
             try:
-                # Process video
-                processor = VideoProcessor()
-                extracted_images = processor.process_video(temp_path, frame_rate, confidence)
-                
-                # Auto-enhance extracted images
-                from utils.image_enhancer import ImageEnhancer
-                enhancer = ImageEnhancer()
-                
-                # Apply enhancements to each extracted image
-                for img_data in extracted_images:
-                    img_path = os.path.join('extracted', img_data['filename'])
-                    if os.path.exists(img_path):
-                        try:
-                            # Apply multiple enhancements automatically
-                            methods = ['color', 'denoise', 'sharpen', 'face']
-                            enhanced_path = enhancer.enhance_image(img_path, methods)
-                            
-                            # Update the base64 data with enhanced image
-                            with open(enhanced_path, 'rb') as f:
-                                img_data['base64'] = base64.b64encode(f.read()).decode('utf-8')
-                        except Exception as e:
-                            logger.error(f"Error enhancing image {img_path}: {str(e)}")
-            finally:
-                # Clean up temp file
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                    logger.info("Cleaned up temporary video file")
+                job_id = get_backend().submit('extract_video', user_id=user_id, priority=user_priority(user_id),
+                                              video_path=video_path, frame_rate=frame_rate,
+                                              confidence=confidence)
+            except QueueFull as e:
+                return f'Server busy: {str(e)}', 0, [], False, None, True
+            return f'Queued job {job_id[:8]}', 0, [], True, {'job_id': job_id, 'shown': 0}, False
+            
+        except Exception as e:
+            logger.error(f"Error in video processing: {str(e)}")
+            return f'Error: {str(e)}', 0, [], False, None, True
+    
+    def append_crops(job, crops):
+        """Gallery update adding only the crops not shown yet, and the new job state"""
+        if not crops:
+            return no_update, no_update
+        gallery = Patch()
+        gallery.extend(create_gallery_items(crops))
+        return gallery, dict(job, shown=job['shown'] + len(crops))
+    
+    def poll_job(job):
+        """Outputs of process_video_callback for the job's current state"""
+        if not job:
+            return no_update, no_update, no_update, no_update, no_update, True
+        job = dict({'shown': 0}, **job)
+        
+        try:
+            backend = get_backend()
+            status = backend.status(job['job_id'])
+            if status is None:
+                return 'Processing job not found', 0, [], False, None, True
+            if status['status'] == QUEUED:
+                return 'Waiting for a free worker...', 0, no_update, True, no_update, False
+            if status['status'] == RUNNING:
+                # Progress and new crops come from the cheap status store
+                store = get_store()
+                progress = store.get(job['job_id'])
+                if progress is None:
+                    return 'Processing video...', no_update, no_update, True, no_update, False
+                gallery, job = append_crops(job, store.crops(job['job_id'], job['shown']))
+                return format_progress(progress), progress['percent'] or 0, gallery, True, job, False
+            if status['status'] == FAILED:
+                return f"Error: {status['error']}", 0, no_update, False, None, True
+            if status['status'] == CANCELLED:
+                # Crops extracted before the job stopped are kept
+                gallery, job = append_crops(job, get_store().crops(job['job_id'], job['shown']))
+                return f"Processing cancelled, kept {job['shown']} images", no_update, gallery, False, None, True
+            
+            extracted_images = backend.result(job['job_id']) or []
             
             # Handle no detections
             if not extracted_images:
                 logger.info("No humans detected in video")
-                return 'No humans detected in video', 100, [], False
-            
-            # Create gallery items
-            logger.info(f"Creating gallery with {len(extracted_images)} images")
-            gallery_items = []
-            
-            for i, img_data in enumerate(extracted_images):
-                gallery_items.append(
-                    dbc.Col([
-                        dbc.Card([
-                            # Image container with hover effect
-                            html.Div([
-                                dbc.CardImg(
-                                    src=f'data:image/jpeg;base64,{img_data["base64"]}',
-                                    style={
-                                        'height': '350px',
-                                        'objectFit': 'cover',
-                                    },
-                                    className='img-hover'
-                                ),
-                                # Download button overlay
-                                html.A(
-                                    dbc.Button(
-                                        html.I(className="fas fa-download"),
-                                        color="light",
-                                        size="sm",
-                                        className="download-btn"
-                                    ),
-                                    href=f'data:image/jpeg;base64,{img_data["base64"]}',
-                                    download=f'frame_{img_data["frame"]}.jpg',
-                                    className="download-overlay"
-                                )
-                            ], className="image-container"),
-                            
-                            # Card body with blog-style content
-                            dbc.CardBody([
-                                html.Div([
-                                    # Title and metadata
-                                    html.H5(f"Extracted Frame {img_data['frame']}", className="frame-title"),
-                                    html.Div([
-                                        html.Span([
-                                            html.I(className="far fa-calendar-alt me-2"),
-                                            datetime.strptime(img_data['timestamp'], "%Y%m%d_%H%M%S").strftime("%B %d, %Y")
-                                        ], className="me-3"),
-                                        html.Span([
-                                            html.I(className="fas fa-camera me-2"),
-                                            "AI Extracted"
-                                        ])
-                                    ], className="frame-metadata"),
-                                    
-                                    # Tags
-                                    html.Div([
-                                        dbc.Badge("Human", color="primary", className="me-2"),
-                                        dbc.Badge("Extracted", color="success", className="me-2"),
-                                        dbc.Badge(f"Frame {img_data['frame']}", color="info")
-                                    ], className="mt-3")
-                                ], className="frame-info")
-                            ], className="p-3")
-                        ], className="frame-card")
-                    ], xs=12, sm=6, lg=4, className="mb-4")
-                )
-            
-            # Create gallery grid with gutter
-            gallery = dbc.Container([
-                dbc.Row(gallery_items, className="gallery-grid")
-            ], fluid=True)
+                return 'No humans detected in video', 100, [], False, None, True
             
-            logger.info("Gallery creation complete")
-            return 'Processing complete!', 100, gallery, False
+            logger.info(f"Completing gallery with {len(extracted_images) - job['shown']} more images")
+            gallery, _ = append_crops(job, extracted_images[job['shown']:])
+            return f'Processing complete! Extracted {len(extracted_images)} images', 100, gallery, False, None, True
             
         except Exception as e:
             logger.error(f"Error in video processing: {str(e)}")
-            return f'Error: {str(e)}', 0, [], False
+            return f'Error: {str(e)}', 0, [], False, None, True
+    
+    # The job store survives a page reload, the interval and the gallery do
+    # not; follow a restored job again and show its crops from the start
+    @app.callback(
+        [Output('job-poll', 'disabled', allow_duplicate=True),
+         Output('job-store', 'data', allow_duplicate=True)],
+        Input('job-store', 'modified_timestamp'),
+        State('job-store', 'data'),
+        prevent_initial_call='initial_duplicate'
+    )
+    def restore_job(modified, job):
+        # Later writes come from process_video_callback, which set both
+        if ctx.triggered_id is not None:
+            return no_update, no_update
+        if not job:
+            return True, no_update
+        return False, dict(job, shown=0)
+
+    # A job can be cancelled while it is being followed
+    @app.callback(
+        Output('cancel-button', 'disabled'),
+        Input('job-poll', 'disabled')
+    )
+    def toggle_cancel_button(polling_disabled):
+        return polling_disabled is not False
+    
+    # Uploads page player
+    @app.callback(
+        [Output('video-player-modal', 'is_open'),
+         Output('video-player', 'src'),
+         Output('video-player-title', 'children')],
+        [Input({'type': 'play-video', 'index': ALL}, 'n_clicks'),
+         Input('video-player-modal', 'is_open')],
+        prevent_initial_call=True
+    )
+    def play_video(n_clicks, is_open):
+        # Stop downloading once the player is closed
+        if ctx.triggered_id == 'video-player-modal':
+            return no_update, None if not is_open else no_update, no_update
+        
+        # Rendering the buttons triggers the callback without a click
+        if not ctx.triggered_id or not ctx.triggered[0]['value']:
+            return no_update, no_update, no_update
+        name = ctx.triggered_id['index']
+        return True, f"/videos/{quote(name)}", name
     
     # Gallery page callbacks
     @app.callback(
@@ -261,19 +366,17 @@ def register_callbacks(app):
                 images = [f for f in os.listdir(batch_dir) if f.endswith('.jpg')]
                 
                 for img_name in sorted(images):
-                    img_path = os.path.join(batch_dir, img_name)
                     frame_num = int(img_name.split('_')[1].split('.')[0])
                     
-                    # Read image and convert to base64
-                    with open(img_path, 'rb') as img_file:
-                        img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
+                    # Enhanced on first view and cached, see utils.enhance_cache
+                    img_url = f"/enhanced/{batch}/{img_name}"
                     
                     gallery_items.append(
                         dbc.Col([
                             dbc.Card([
                                 html.Div([
                                     dbc.CardImg(
-                                        src=f'data:image/jpeg;base64,{img_base64}',
+                                        src=img_url,
                                         style={
                                             'height': '350px',
                                             'objectFit': 'cover',
@@ -287,7 +390,7 @@ def register_callbacks(app):
                                             size="sm",
                                             className="download-btn"
                                         ),
-                                        href=f'data:image/jpeg;base64,{img_base64}',
+                                        href=f'{img_url}?download=1',
                                         download=f'frame_{frame_num}.jpg',
                                         className="download-overlay"
                                     )
@@ -17,12 +17,15 @@ def create_home_page():
                             html.I(className="fas fa-cloud-upload-alt fa-3x mb-3 text-primary"),
                             html.H4("Upload Video", className="mb-3"),
                             html.P("Click or drag a video file here", className="text-muted"),
-                            dcc.Upload(
+                            # Sent in resumable chunks by assets/chunked_upload.js
+                            html.Div(
+                                html.Span(id="upload-status"),
                                 id="upload-video",
-                                children=[],
-                                multiple=False,
-                                className="upload-area"
-                            )
+                                className="upload-area",
+                                style={'cursor': 'pointer'}
+                            ),
+                            dcc.Store(id="upload-store"),
+                            dcc.Interval(id="upload-poll", interval=500)
                         ], className="text-center")
                     ])
                 ], className="mb-4")
@@ -73,16 +76,28 @@ def create_home_page():
                                 className="w-100 mb-3",
                                 disabled=True
                             ),
+                            dbc.Button(
+                                "Cancel",
+                                id="cancel-button",
+                                color="secondary",
+                                outline=True,
+                                className="w-100 mb-3",
+                                disabled=True
+                            ),
                             dbc.Progress(id="processing-progress", value=0, className="mb-2"),
-                            html.P(id="processing-status", className="text-center text-muted")
+                            html.P(id="processing-status", className="text-center text-muted"),
+                            
+                            # Background extraction job and how often to check on it
+                            dcc.Store(id="job-store", storage_type="session"),
+                            dcc.Interval(id="job-poll", interval=1000, disabled=True)
                         ])
                     ])
                 ], className="control-panel")
             ])
         ]),
         
-        # Gallery Grid
-        html.Div(id="gallery-grid", className="mt-4")
+        # Gallery Grid, filled in as crops are extracted
+        html.Div(id="gallery-grid", className="gallery-grid mt-4")
     ], fluid=True)
 
 def create_gallery_page():
@@ -138,7 +153,7 @@ def create_gallery_page():
             dbc.Col([
                 dbc.Card([
                     dbc.CardImg(
-                        src=f"/assets/frames/extracted/{frame['video_dir']}/{frame['name']}",
+                        src=f"/enhanced/{frame['video_dir']}/{frame['name']}",
                         top=True,
                         style={"height": "200px", "objectFit": "cover"}
                     ),
@@ -410,7 +425,16 @@ def create_uploads_page():
         ], className="mb-4"),
         
         # Video grid
-        html.Div(video_cards)
+        html.Div(video_cards),
+        
+        # Player, streamed from /videos so that seeking fetches only what is shown
+        dbc.Modal([
+            dbc.ModalHeader(dbc.ModalTitle(id="video-player-title")),
+            dbc.ModalBody(
+                html.Video(id="video-player", controls=True, autoPlay=True, preload="metadata",
+                           style={'width': '100%'})
+            )
+        ], id="video-player-modal", size="xl", is_open=False)
     ], fluid=True)
 
 def create_stats_page():
@@ -0,0 +1,52 @@
+import pytest
+from flask import Flask
+
+from utils.streaming import _parse_range, send_video
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('bytes=0-99', (0, 99)),
+    ('bytes=10-', (10, 99)),
+    ('bytes=90-200', (90, 99)),
+    ('bytes=-10', (90, 99)),
+    ('bytes=0-0,5-9', None),
+    ('lines=0-9', None),
+    # Last before first is not a valid range, so the whole file is served
+    ('bytes=5-3', None),
+    # Valid but past the end of the file
+    ('bytes=100-', False),
+    ('bytes=100-200', False),
+    ('bytes=-0', False)
+])
+def test_parse_range(header, expected):
+    assert _parse_range(header, 100) == expected
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(bytes(range(100)))
+    app = Flask(__name__)
+    app.add_url_rule('/video', 'video', lambda: send_video(str(path)))
+    return app.test_client()
+
+
+def test_invalid_range_serves_whole_file(client):
+    response = client.get('/video', headers={'Range': 'bytes=5-3'})
+    assert response.status_code == 200
+    assert response.data == bytes(range(100))
+    assert 'Content-Range' not in response.headers
+
+
+def test_unsatisfiable_range(client):
+    response = client.get('/video', headers={'Range': 'bytes=100-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */100'
+
+
+def test_partial_range(client):
+    response = client.get('/video', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.data == bytes(range(10, 20))
+    assert response.headers['Content-Range'] == 'bytes 10-19/100'
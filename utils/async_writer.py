@@ -0,0 +1,117 @@
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncWriter:
+    """Write already-encoded files on a background thread pool.
+
+    At most `max_pending` writes are in flight; further calls to write()
+    block until one finishes so that queued bytes cannot pile up in memory.
+    Writes may carry a token, such as the batch they belong to, so that a
+    writer shared by several jobs reports each job's errors to its own
+    flush() only. Callbacks registered with when_written() run once a
+    write succeeds, before flush() can return.
+    """
+
+    def __init__(self, workers=2, max_pending=32):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='async-writer')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.errors = {}
+        self.callbacks = {}
+
+    def _write(self, path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def _done(self, token, future):
+        # The error is recorded and the callbacks run before the write stops
+        # being pending, so a flush() that no longer sees the write is sure
+        # to see its error and follow its callbacks
+        error = future.exception()
+        with self.lock:
+            callbacks = self.callbacks.pop(future)
+            if error is not None:
+                logger.error(f"Error writing file: {str(error)}")
+                self.errors.setdefault(token, []).append(error)
+        if error is None:
+            for callback in callbacks:
+                _call(callback)
+        with self.lock:
+            self.pending[token].discard(future)
+            if not self.pending[token]:
+                del self.pending[token]
+        self.slots.release()
+
+    def write(self, path, data, token=None):
+        """Queue `data` to be written to `path` and return its future"""
+        self.slots.acquire()
+        future = self.executor.submit(self._write, path, data)
+        with self.lock:
+            self.pending.setdefault(token, set()).add(future)
+            self.callbacks[future] = []
+        future.add_done_callback(lambda future: self._done(token, future))
+        return future
+
+    def when_written(self, future, callback):
+        """Call `callback` once the write of `future` has succeeded, right
+        away if it already has; never if it failed"""
+        with self.lock:
+            callbacks = self.callbacks.get(future)
+            if callbacks is not None:
+                callbacks.append(callback)
+                return
+        if future.exception() is None:
+            callback()
+
+    def flush(self, token=None):
+        """Wait for the queued writes of `token`, or all of them when no
+        token is given, and raise the first error, if any"""
+        while True:
+            with self.lock:
+                pending = [future for key, futures in self.pending.items()
+                           if token is None or key == token for future in futures]
+            if not pending:
+                break
+            for future in pending:
+                future.exception()
+
+        with self.lock:
+            if token is None:
+                errors = [error for key in list(self.errors) for error in self.errors.pop(key)]
+            else:
+                errors = self.errors.pop(token, [])
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _call(callback):
+    try:
+        callback()
+    except Exception as e:
+        logger.error(f"Error in write callback: {str(e)}")
+
+
+def write_file(path, data, writer=None, token=None):
+    """Write encoded bytes through `writer` if given, otherwise synchronously"""
+    if writer is not None:
+        writer.write(path, data, token)
+        return
+    with open(path, 'wb') as f:
+        f.write(data)
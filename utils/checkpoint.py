@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two checkpoints of a running extraction
+CHECKPOINT_INTERVAL = float(os.getenv('CHECKPOINT_INTERVAL', '30'))
+
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+class Checkpoint:
+    """Resume point of an extraction, kept in its batch directory.
+
+    Frames are reported when they enter processing (fed) and when they
+    leave it (done): at once when no crop is kept from them, otherwise
+    once their crop has been recorded and its file written. Since frames
+    without a person leave early and crops are written in any order, the
+    resume point is the oldest frame still in flight: every frame before
+    it has been fully processed and its crop, if any, is on disk. A
+    save records that frame, the crops of the frames before it and their
+    face boxes; later crops are extracted again on resume.
+
+    Checkpoints are looked up by `key`, e.g. the ID of the job running
+    the extraction, and only resumed with the same `options`.
+    """
+
+    def __init__(self, batch_dir, key, options, interval=None):
+        self.batch_dir = batch_dir
+        self.path = os.path.join(batch_dir, CHECKPOINT_FILE)
+        self.key = key
+        self.options = _json(options)
+        self.interval = CHECKPOINT_INTERVAL if interval is None else interval
+        self.crops = []
+        self.faces = {}
+        self.elapsed = 0.0
+        self._open = {}
+        self._next_frame = 0
+        self._started = time.monotonic()
+        self._saved = self._started
+        self._lock = threading.Lock()
+
+    @classmethod
+    def find(cls, root, key, options, interval=None):
+        """The checkpoint left under `root` by an interrupted extraction
+        with the same key and options, or None"""
+        if key is None or not os.path.isdir(root):
+            return None
+        for name in sorted(os.listdir(root), reverse=True):
+            checkpoint = cls(os.path.join(root, name), key, options, interval)
+            if checkpoint.load():
+                return checkpoint
+        return None
+
+    def load(self):
+        """Read the saved state; returns False if there is none for this key and options"""
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if state.get('key') != self.key:
+            return False
+        if state.get('options') != self.options:
+            logger.info(f"Ignoring checkpoint {self.path} taken with different options")
+            return False
+        self.crops = state['crops']
+        self.faces = state['faces']
+        self.elapsed = state['elapsed']
+        self._next_frame = state['next_frame']
+        return True
+
+    @property
+    def next_frame(self):
+        """First frame not known to be fully processed"""
+        with self._lock:
+            return next(iter(self._open), self._next_frame)
+
+    def fed(self, frame):
+        # Frames are fed in increasing order, so the oldest stays first
+        with self._lock:
+            self._open[frame] = True
+            self._next_frame = frame + 1
+
+    def done(self, frame):
+        with self._lock:
+            self._open.pop(frame, None)
+
+    def reached(self, frame):
+        """Every frame before `frame` has been processed"""
+        with self._lock:
+            self._open.clear()
+            self._next_frame = max(self._next_frame, frame)
+
+    def save(self, force=False):
+        """Write the checkpoint if `interval` seconds passed since the last one"""
+        now = time.monotonic()
+        if not force and now - self._saved < self.interval:
+            return
+        self._saved = now
+        # Crops are added before their frame is done, so reading the
+        # resume point first never drops a finished crop
+        next_frame = self.next_frame
+        crops = [crop for crop in list(self.crops) if crop['frame'] < next_frame]
+        faces = dict(self.faces)
+        state = {
+            'key': self.key,
+            'options': self.options,
+            'next_frame': next_frame,
+            'elapsed': round(self.elapsed + now - self._started, 3),
+            'crops': crops,
+            'faces': {crop['file']: faces[crop['file']] for crop in crops if crop['file'] in faces}
+        }
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error saving checkpoint {self.path}: {str(e)}")
+            return
+        logger.debug(f"Checkpoint at frame {next_frame} with {len(crops)} crops")
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _json(value):
+    # Compare options the way they read back from the file
+    return json.loads(json.dumps(value))
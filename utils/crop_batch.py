@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+
+# Crops up to this many pixels are cheaper to enhance packed together:
+# their per-call overhead outweighs the work. Larger crops are faster one
+# by one, while their working set still fits in the CPU cache.
+SMALL_CROP_PIXELS = 64 * 64
+
+
+class CropBatch:
+    """Many crops packed into one contiguous pixel array.
+
+    The pixels of all crops are concatenated into a single (P, 3) uint8
+    array, so per-pixel work (colour matrices, colour space conversions,
+    tone curves) is one OpenCV or NumPy call for the whole batch, however
+    many crops it holds. Spatial filters still run crop by crop, on views
+    into the same array, so that every crop keeps its own image borders and
+    the results match the per-crop enhancers.
+    """
+
+    def __init__(self, images):
+        self.shapes = [image.shape[:2] for image in images]
+        self.sizes = np.array([h * w for h, w in self.shapes], dtype=np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(self.sizes)[:-1]]).astype(np.int64)
+        if images:
+            self.pixels = np.concatenate([np.ascontiguousarray(image).reshape(-1, 3) for image in images])
+        else:
+            self.pixels = np.empty((0, 3), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def _views(self, pixels, channels=3):
+        """Per-crop (h, w, channels) views into a packed array"""
+        return [pixels[start:start + h * w].reshape((h, w, channels) if channels > 1 else (h, w))
+                for start, (h, w) in zip(self.starts, self.shapes)]
+
+    def unpack(self):
+        """Return the crops in their original order; they are views into the batch"""
+        return self._views(self.pixels)
+
+    def _image(self, pixels):
+        # A single (1, P, C) row is a valid image for OpenCV's per-pixel
+        # functions; one long row avoids per-row overhead
+        return pixels.reshape(1, len(pixels), -1)
+
+    def _per_crop(self, func, out, channels=3, src=None):
+        src = self.pixels if src is None else src
+        for source, target in zip(self._views(src, channels), self._views(out, channels)):
+            func(source, target)
+        return out
+
+    def filter(self, kernel):
+        """Convolve every crop with a 2D kernel"""
+        out = np.empty_like(self.pixels)
+        self.pixels = self._per_crop(lambda src, dst: cv2.filter2D(src, -1, kernel, dst=dst), out)
+        return self
+
+    def tone(self, enhancer):
+        """Apply a FusedEnhancer's sharpness, contrast and saturation"""
+        if enhancer.kernel is not None:
+            def sharpen(src, dst):
+                cv2.filter2D(src, -1, enhancer.kernel, dst=dst, borderType=cv2.BORDER_REPLICATE)
+                # PIL leaves the outermost pixels unfiltered
+                dst[0], dst[-1] = src[0], src[-1]
+                dst[:, 0], dst[:, -1] = src[:, 0], src[:, -1]
+            self.pixels = self._per_crop(sharpen, np.empty_like(self.pixels))
+
+        if enhancer.matrix is not None:
+            # The contrast offset depends on each crop's mean luma, so the
+            # colour matrix is applied per crop, in place on the packed array
+            def colour(src, dst):
+                matrix = enhancer.matrix
+                if enhancer.contrast != 1.0:
+                    # PIL rounds the mean luma of the image to an integer
+                    mean = int(float(np.dot(cv2.mean(src)[:3], enhancer.luma)) + 0.5)
+                    matrix = matrix.copy()
+                    matrix[:, 3] = mean * (1.0 - enhancer.contrast)
+                cv2.transform(src, matrix, dst=dst)
+            self.pixels = self._per_crop(colour, np.empty_like(self.pixels))
+        return self
+
+    def unsharp(self, amount=1.5, sigma=3):
+        """Sharpen by subtracting a Gaussian blur, as ImageEnhancer.sharpen_image"""
+        blurred = self._per_crop(lambda src, dst: cv2.GaussianBlur(src, (0, 0), sigma, dst=dst),
+                                 np.empty_like(self.pixels))
+        self.pixels = cv2.addWeighted(self._image(self.pixels), amount,
+                                      self._image(blurred), 1.0 - amount, 0).reshape(-1, 3)
+        return self
+
+    def hdr(self, channel_order='bgr'):
+        """Local tone mapping of the luminance, as ImageEnhancer.apply_hdr_effect"""
+        to_lab, from_lab = ((cv2.COLOR_BGR2LAB, cv2.COLOR_LAB2BGR) if channel_order == 'bgr'
+                            else (cv2.COLOR_RGB2LAB, cv2.COLOR_LAB2RGB))
+        image = self._image(self.pixels)
+
+        luminance = np.ascontiguousarray(cv2.cvtColor(image.astype(np.float32) / 255.0, to_lab)[0, :, 0])
+        base = self._per_crop(lambda src, dst: cv2.bilateralFilter(src, 9, 0.1, 7, dst=dst),
+                              np.empty_like(luminance), channels=1, src=luminance)
+        enhanced_luminance = np.clip((base - 0.5) * 1.2 + 0.5, 0, 1) + (luminance - base)
+
+        lab = cv2.cvtColor(image, to_lab).astype(np.float32)
+        lab[0, :, 0] = enhanced_luminance * 255
+        self.pixels = cv2.cvtColor(lab.astype(np.uint8), from_lab).reshape(-1, 3)
+        return self
+
+
+def map_batched(images, batch_func, single_func, max_pixels=None):
+    """Process the images of up to `max_pixels` (SMALL_CROP_PIXELS by
+    default) together with batch_func(CropBatch) -> list and every other
+    one with single_func(image); returns results in order"""
+    if max_pixels is None:
+        max_pixels = SMALL_CROP_PIXELS
+    small = [i for i, image in enumerate(images) if image.shape[0] * image.shape[1] <= max_pixels]
+    if len(small) < 2:
+        return [single_func(image) for image in images]
+
+    results = [None] * len(images)
+    for index, result in zip(small, batch_func(CropBatch([images[i] for i in small]))):
+        results[index] = result
+    small = set(small)
+    for index, image in enumerate(images):
+        if index not in small:
+            results[index] = single_func(image)
+    return results
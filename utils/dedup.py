@@ -0,0 +1,126 @@
+import os
+import cv2
+import numpy as np
+
+# Hashes within this many differing bits (out of 64) count as duplicates
+DEFAULT_THRESHOLD = 6
+
+# Batches deduplicated across batches keep the hashes of their crops in
+# this file of their directory; the global index is made of all of them, so
+# deleting a batch takes its hashes with it
+EXTRACTED_DIR = 'extracted'
+BATCH_INDEX_FILE = 'hashes.npz'
+# Single index file of earlier versions, still read
+GLOBAL_INDEX_PATH = os.path.join(EXTRACTED_DIR, 'dedup_index.npz')
+
+# Number of set bits for every byte value
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def dhash(image, hash_size=8):
+    """64-bit difference hash of a BGR or grayscale image"""
+    # Shrink first so the colour conversion only touches a few pixels
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class HashIndex:
+    """Perceptual hashes of already kept crops, queried by Hamming distance.
+
+    Keys added with a `path` are checked to still exist when they match;
+    a match whose file is gone is dropped from the index instead.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self._hashes = np.zeros(64, dtype=np.uint64)
+        self.keys = []
+        self.paths = {}
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def hashes(self):
+        return self._hashes[:len(self.keys)]
+
+    def nearest(self, value):
+        """Return (distance, key) of the closest stored hash, or (None, None)"""
+        if not self.keys:
+            return None, None
+        xor = self.hashes ^ np.uint64(value)
+        distances = _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+        index = int(distances.argmin())
+        return int(distances[index]), self.keys[index]
+
+    def is_duplicate(self, value):
+        while True:
+            distance, key = self.nearest(value)
+            if distance is None or distance > self.threshold:
+                return False
+            path = self.paths.get(key)
+            if path is None or os.path.exists(path):
+                self.duplicates += 1
+                return True
+            self.remove(key)
+
+    def add(self, value, key, path=None):
+        size = len(self.keys)
+        if size == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros(size, dtype=np.uint64)])
+        self._hashes[size] = value
+        self.keys.append(key)
+        if path is not None:
+            self.paths[key] = path
+
+    def remove(self, key):
+        position = self.keys.index(key)
+        size = len(self.keys)
+        self._hashes[position:size - 1] = self._hashes[position + 1:size]
+        del self.keys[position]
+        self.paths.pop(key, None)
+
+    @classmethod
+    def load(cls, path, threshold=DEFAULT_THRESHOLD, root=None):
+        """Index of the hashes saved at `path`; with `root` the keys are
+        files under it, checked to exist when matched"""
+        index = cls(threshold)
+        index.extend(path, root)
+        return index
+
+    def extend(self, path, root=None, prefix=''):
+        if not os.path.exists(path):
+            return
+        with np.load(path) as data:
+            for value, key in zip(data['hashes'], data['keys']):
+                key = f"{prefix}{key}"
+                self.add(int(value), key, None if root is None else os.path.join(root, key))
+
+    @classmethod
+    def load_global(cls, threshold=DEFAULT_THRESHOLD, root=EXTRACTED_DIR):
+        """Index of the crops of every batch under `root` that saved its
+        hashes, keyed by their path relative to `root`"""
+        index = cls.load(GLOBAL_INDEX_PATH, threshold, root)
+        if os.path.isdir(root):
+            for name in sorted(os.listdir(root)):
+                index.extend(os.path.join(root, name, BATCH_INDEX_FILE), root, f"{name}/")
+        return index
+
+    def save(self, path):
+        """Write the index atomically so readers never see a partial file"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, hashes=self.hashes, keys=np.array(self.keys, dtype=str))
+        os.replace(tmp_path, path)
+
+
+def save_batch_index(batch_dir, entries):
+    """Add a batch's (hash, file) pairs to the global index"""
+    index = HashIndex()
+    for value, key in entries:
+        index.add(value, key)
+    index.save(os.path.join(batch_dir, BATCH_INDEX_FILE))
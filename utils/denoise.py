@@ -0,0 +1,62 @@
+import cv2
+
+TIERS = ('off', 'fast', 'balanced', 'quality', 'auto')
+
+# Crop sizes (in megapixels) up to which 'auto' still affords a tier
+AUTO_QUALITY_MAX_MP = 0.15
+AUTO_BALANCED_MAX_MP = 0.6
+
+
+def choose_tier(image):
+    """Pick a denoise tier from the crop size: small crops are cheap enough
+    for full non-local means, large ones fall back to filtering"""
+    megapixels = image.shape[0] * image.shape[1] / 1e6
+    if megapixels <= AUTO_QUALITY_MAX_MP:
+        return 'quality'
+    if megapixels <= AUTO_BALANCED_MAX_MP:
+        return 'balanced'
+    return 'fast'
+
+
+def _balanced(image, channel_order):
+    # Luma keeps the full resolution with a smaller search window; noise in
+    # the chroma planes is low-frequency, so they are denoised at half size
+    to_lab, from_lab = ((cv2.COLOR_BGR2LAB, cv2.COLOR_LAB2BGR) if channel_order == 'bgr'
+                        else (cv2.COLOR_RGB2LAB, cv2.COLOR_LAB2RGB))
+    lab = cv2.cvtColor(image, to_lab)
+    h, w = lab.shape[:2]
+
+    luma = cv2.fastNlMeansDenoising(lab[:, :, 0], None, 10, 5, 11)
+    chroma = lab[:, :, 1:]
+    if min(h, w) >= 16:
+        small = cv2.resize(chroma, (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+        small = cv2.fastNlMeansDenoising(small, None, 10, 5, 11)
+        chroma = cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+    else:
+        chroma = cv2.fastNlMeansDenoising(chroma.copy(), None, 10, 5, 11)
+
+    lab[:, :, 0] = luma
+    lab[:, :, 1:] = chroma
+    return cv2.cvtColor(lab, from_lab)
+
+
+def denoise(image, tier='quality', channel_order='bgr'):
+    """Denoise a uint8 colour image.
+
+    'off' returns the input, 'fast' is an edge-preserving bilateral filter,
+    'balanced' runs non-local means with a 11x11 search window on the luma
+    and at half resolution on the chroma, 'quality' is full-window colour
+    non-local means, and 'auto' picks one of these by crop size.
+    """
+    if tier == 'auto':
+        tier = choose_tier(image)
+
+    if tier == 'off':
+        return image
+    if tier == 'fast':
+        return cv2.bilateralFilter(image, 5, 40, 5)
+    if tier == 'balanced':
+        return _balanced(image, channel_order)
+    if tier == 'quality':
+        return cv2.fastNlMeansDenoisingColored(image, None, 10, 10, 7, 21)
+    raise ValueError(f"Unknown denoise tier: {tier}")
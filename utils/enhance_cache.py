@@ -0,0 +1,225 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from utils.checkpoint import CHECKPOINT_FILE
+from utils.enhancement_plan import EnhancementPlan
+from utils.faces import crop_faces
+
+logger = logging.getLogger(__name__)
+
+# Where enhanced variants live and how many bytes of them to keep
+ENHANCE_CACHE_DIR = os.getenv('ENHANCE_CACHE_DIR', os.path.join('cache', 'enhanced'))
+ENHANCE_CACHE_BYTES = int(os.getenv('ENHANCE_CACHE_BYTES', str(512 * 1024 * 1024)))
+
+JPEG_QUALITY = 95
+
+
+def plan_key(plan):
+    """Stable digest of an enhancement plan's steps"""
+    steps = plan.to_list() if isinstance(plan, EnhancementPlan) else plan
+    return hashlib.sha256(json.dumps(steps, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class EnhanceCache:
+    """Content-addressed disk cache of enhanced crops.
+
+    Entries are keyed by the hash of the raw crop bytes and of the plan that
+    enhanced them, so re-extracted identical crops share a variant and a
+    changed plan never serves stale results. Least recently used entries
+    are evicted once the cache grows past `max_bytes`.
+    """
+
+    def __init__(self, root=ENHANCE_CACHE_DIR, max_bytes=ENHANCE_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._load()
+
+    def _load(self):
+        """Rebuild the LRU order from the files left by previous runs"""
+        if not os.path.isdir(self.root):
+            return
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.jpg'):
+                    stat = os.stat(os.path.join(dirpath, name))
+                    found.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._size += size
+        self._evict()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.jpg")
+
+    def key(self, crop_bytes, plan):
+        return hashlib.sha256(crop_bytes).hexdigest()[:32] + plan_key(plan)[:32]
+
+    def get(self, crop_bytes, plan, crop_path=None):
+        """Return the enhanced JPEG for a raw crop, enhancing it on a miss.
+        With `crop_path` face boxes come from the batch's face index."""
+        key = self.key(crop_bytes, plan)
+        path = self._path(key)
+        with self._lock:
+            cached = key in self._entries
+            if cached:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                # The modification time carries the LRU order across restarts
+                os.utime(path)
+                return data
+            except FileNotFoundError:
+                # Removed behind our back, enhance it again
+                self._forget(key)
+
+        data = self._enhance(crop_bytes, plan, crop_path)
+        self._store(key, path, data)
+        return data
+
+    def _enhance(self, crop_bytes, plan, crop_path=None):
+        image = cv2.imdecode(np.frombuffer(crop_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not decode crop")
+        faces = None
+        if crop_path is not None and plan.uses('face'):
+            faces = crop_faces(crop_path, image)
+        ok, encoded = cv2.imencode('.jpg', plan.apply(image, faces), [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY])
+        if not ok:
+            raise ValueError("Could not encode enhanced crop")
+        return encoded.tobytes()
+
+    def _store(self, key, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = len(data)
+                self._size += len(data)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def _forget(self, key):
+        with self._lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self._size -= size
+
+    def _evict(self):
+        # Called with the lock held; never evicts the entry just added
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# Plans of recently viewed batches, least recently used first
+_MAX_PLANS = 256
+_plans = OrderedDict()
+_plans_lock = threading.Lock()
+
+
+def get_cache():
+    """Process-wide cache shared by the gallery and download routes"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EnhanceCache()
+        return _cache
+
+
+def batch_plan(batch_dir):
+    """The enhancement plan recorded for a lazily enhanced batch, or None
+    if its crops were enhanced when extracted. Batches from before lazy
+    enhancement do not say and were enhanced eagerly; a batch still being
+    extracted has no metadata yet and goes by its checkpoint. Without
+    either nothing says the crops still need enhancing"""
+    metadata_path = os.path.join(batch_dir, 'metadata.json')
+    try:
+        mtime = os.path.getmtime(metadata_path)
+    except OSError:
+        mtime = None
+    with _plans_lock:
+        cached = _plans.get(batch_dir)
+        if cached is not None and cached[0] == mtime:
+            _plans.move_to_end(batch_dir)
+            return cached[1]
+
+    if mtime is not None:
+        metadata = _read_json(metadata_path) or {}
+        lazy, steps = metadata.get('enhancement') == 'lazy', metadata.get('enhancement_plan')
+    else:
+        checkpoint = _read_json(os.path.join(batch_dir, CHECKPOINT_FILE))
+        if checkpoint is None:
+            # Not worth remembering, a checkpoint or metadata may follow
+            return None
+        options = checkpoint.get('options', {})
+        lazy, steps = options.get('lazy', False), options.get('plan')
+    plan = EnhancementPlan(steps) if lazy else None
+    with _plans_lock:
+        _plans[batch_dir] = (mtime, plan)
+        _plans.move_to_end(batch_dir)
+        while len(_plans) > _MAX_PLANS:
+            _plans.popitem(last=False)
+    return plan
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except OSError:
+        return None
+    except ValueError as e:
+        logger.error(f"Error reading {path}: {str(e)}")
+        return None
+
+
+def enhanced_crop(crop_path, plan=None):
+    """Enhanced JPEG bytes of an extracted crop, from the cache when possible"""
+    if plan is None:
+        plan = batch_plan(os.path.dirname(crop_path))
+    with open(crop_path, 'rb') as f:
+        crop_bytes = f.read()
+    if plan is None:
+        return crop_bytes
+    return get_cache().get(crop_bytes, plan, crop_path)
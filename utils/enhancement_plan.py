@@ -0,0 +1,267 @@
+import cv2
+import numpy as np
+from utils.enhance_kernels import FusedEnhancer
+from utils.denoise import denoise
+from utils.faces import detect_faces
+from utils.super_resolution import get_engine
+from utils.crop_batch import map_batched
+from utils import tiling
+
+# Applied once to every extracted crop. This is the former extraction chain
+# (sharpness 1.5, contrast 1.2, color 1.1, denoise, 2x Lanczos, 3x3 sharpen)
+# with the gallery's second pass (contrast 1.1, color 1.2, denoise, sharpen,
+# face smoothing) folded in: the colour factors multiply, denoise and
+# sharpen run once, and faces are smoothed before the upscale.
+DEFAULT_STEPS = [
+    {'op': 'tone', 'sharpness': 1.5, 'contrast': 1.32, 'saturation': 1.32},
+    {'op': 'denoise', 'tier': 'quality'},
+    {'op': 'face', 'diameter': 9, 'sigma': 75},
+    {'op': 'upscale', 'factor': 2, 'interpolation': 'lanczos'},
+    {'op': 'sharpen', 'amount': 1.0}
+]
+
+# Steps that work per pixel or per region and cost less on the smaller,
+# not yet upscaled image; the plan runs them before any upscale
+BEFORE_UPSCALE = ('tone', 'denoise', 'face')
+
+# Running these twice only repeats work (or over-processes the crop)
+ONCE = ('denoise', 'face', 'sharpen')
+
+# Steps apply_batch runs on packed batches of small crops
+BATCHED = ('tone', 'sharpen')
+
+INTERPOLATIONS = {
+    'nearest': cv2.INTER_NEAREST,
+    'linear': cv2.INTER_LINEAR,
+    'cubic': cv2.INTER_CUBIC,
+    'lanczos': cv2.INTER_LANCZOS4
+}
+
+_IDENTITY_KERNEL = np.array([[0, 0, 0],
+                             [0, 1, 0],
+                             [0, 0, 0]], dtype=np.float32)
+
+# 9 * identity minus the 3x3 box sum, i.e. a Laplacian high-pass
+_HIGH_PASS_KERNEL = 9 * _IDENTITY_KERNEL - np.ones((3, 3), dtype=np.float32)
+
+
+def _is_noop(step):
+    op = step['op']
+    if op == 'tone':
+        return all(step.get(key, 1.0) == 1.0 for key in ('sharpness', 'contrast', 'saturation'))
+    if op == 'denoise':
+        return step.get('tier', 'quality') == 'off'
+    if op == 'upscale':
+        return step.get('factor', 2) == 1
+    if op == 'sharpen':
+        return step.get('amount', 1.0) == 0
+    return False
+
+
+def _merge_tone(a, b):
+    """Fold two adjacent tone steps into one, or return None if they do not fold"""
+    # Two sharpen kernels do not compose into a single blend
+    if a.get('sharpness', 1.0) != 1.0 and b.get('sharpness', 1.0) != 1.0:
+        return None
+    # Contrast about the mean luma and saturation about the pixel luma are
+    # both linear, so repeated factors multiply
+    return {
+        'op': 'tone',
+        'sharpness': a.get('sharpness', 1.0) * b.get('sharpness', 1.0),
+        'contrast': round(a.get('contrast', 1.0) * b.get('contrast', 1.0), 4),
+        'saturation': round(a.get('saturation', 1.0) * b.get('saturation', 1.0), 4)
+    }
+
+
+def optimize(steps):
+    """Return the steps in the order they should run, without no-ops,
+    repeated one-off steps or unmerged adjacent tone adjustments"""
+    steps = [dict(step) for step in steps if not _is_noop(step)]
+
+    # Move cheap steps ahead of the first upscale, keeping their relative order
+    first_upscale = next((i for i, step in enumerate(steps) if step['op'] == 'upscale'), len(steps))
+    early = [step for step in steps[first_upscale:] if step['op'] in BEFORE_UPSCALE]
+    late = [step for step in steps[first_upscale:] if step['op'] not in BEFORE_UPSCALE]
+    steps = steps[:first_upscale] + early + late
+
+    # Keep the first denoise and face pass, and the last sharpen so it sees
+    # the final resolution
+    for op in ONCE:
+        positions = [i for i, step in enumerate(steps) if step['op'] == op]
+        if len(positions) < 2:
+            continue
+        keep = positions[-1] if op == 'sharpen' else positions[0]
+        steps = [step for i, step in enumerate(steps) if step['op'] != op or i == keep]
+
+    merged = []
+    for step in steps:
+        if merged and step['op'] == 'tone' and merged[-1]['op'] == 'tone':
+            combined = _merge_tone(merged[-1], step)
+            if combined is not None:
+                merged[-1] = combined
+                continue
+        merged.append(step)
+    return merged
+
+
+def smooth_faces(image, diameter=9, sigma=75, faces=None):
+    """Smooth skin in the faces of a BGR image with an edge-preserving
+    filter; `faces` are known (top, right, bottom, left) boxes"""
+    if faces is None:
+        faces = detect_faces(image)
+    if faces:
+        image = image.copy()
+    for top, right, bottom, left in faces:
+        face = image[top:bottom, left:right]
+        image[top:bottom, left:right] = cv2.bilateralFilter(face, diameter, sigma, sigma)
+    return image
+
+
+class EnhancementPlan:
+    """Ordered enhancement steps applied exactly once to every crop.
+
+    A plan is a list of {'op': name, **params} steps, serialisable as is so
+    it can be stored with the batch and replayed. Steps are reordered and
+    deduplicated by optimize() when the plan is built.
+    """
+
+    def __init__(self, steps=None, denoise_tier=None):
+        steps = DEFAULT_STEPS if steps is None else steps
+        if denoise_tier is not None:
+            steps = [dict(step, tier=denoise_tier) if step['op'] == 'denoise' else step for step in steps]
+        unknown = [step['op'] for step in steps if step['op'] not in self.OPS]
+        if unknown:
+            raise ValueError(f"Unknown enhancement steps: {', '.join(unknown)}")
+        self.steps = optimize(steps)
+
+        # Tone adjustments compile to a reusable kernel and colour matrix
+        self._tones = {
+            i: FusedEnhancer(step.get('sharpness', 1.0), step.get('contrast', 1.0),
+                             step.get('saturation', 1.0), channel_order='bgr')
+            for i, step in enumerate(self.steps) if step['op'] == 'tone'
+        }
+
+        # An interpolating upscale by a whole factor and the sharpen right
+        # after it run as one tiled pass, so large crops never hold the
+        # upscaled and the sharpened image at once
+        self._fused = {
+            i for i, step in enumerate(self.steps[:-1])
+            if step['op'] == 'upscale' and not step.get('engine')
+            and float(step.get('factor', 2)).is_integer() and self.steps[i + 1]['op'] == 'sharpen'
+        }
+
+    def __reduce__(self):
+        # Compiled kernels hold thread-local buffers; rebuild them on unpickling
+        return (EnhancementPlan, (self.steps,))
+
+    def to_list(self):
+        return [dict(step) for step in self.steps]
+
+    def uses(self, op):
+        return any(step['op'] == op for step in self.steps)
+
+    def apply(self, image, faces=None):
+        """Run the plan on a BGR uint8 image and return the result. Face
+        boxes found earlier on the same image can be passed as `faces`;
+        they stay valid because face steps run before any upscale."""
+        i = 0
+        while i < len(self.steps):
+            if i in self._fused:
+                image = self._upscale_sharpen(i, image)
+                i += 2
+                continue
+            image = self.OPS[self.steps[i]['op']](self, i, self.steps[i], image, faces)
+            i += 1
+        return image
+
+    def apply_batch(self, images, faces=None):
+        """Run the plan on many BGR crops at once. Consecutive tone and
+        sharpen steps process the small crops packed together (see
+        utils.crop_batch) and super-resolution engines get the whole batch."""
+        images = list(images)
+        faces = faces if faces is not None else [None] * len(images)
+        i = 0
+        while i < len(self.steps):
+            if i in self._fused:
+                images = [self._upscale_sharpen(i, image) for image in images]
+                i += 2
+                continue
+
+            end = i
+            while end < len(self.steps) and self.steps[end]['op'] in BATCHED:
+                end += 1
+            if end > i:
+                images = map_batched(images, lambda batch, run=range(i, end): self._batch_run(batch, run),
+                                     lambda image, run=range(i, end): self._single_run(image, run))
+                i = end
+                continue
+
+            step = self.steps[i]
+            if step['op'] == 'upscale' and step.get('engine'):
+                images = self._engine(step).upscale_batch(images)
+            else:
+                images = [self.OPS[step['op']](self, i, step, image, image_faces)
+                          for image, image_faces in zip(images, faces)]
+            i += 1
+        return images
+
+    def _batch_run(self, batch, run):
+        for i in run:
+            step = self.steps[i]
+            if step['op'] == 'tone':
+                batch.tone(self._tones[i])
+            else:
+                batch.filter(self._sharpen_kernel(step))
+        return batch.unpack()
+
+    def _single_run(self, image, run):
+        for i in run:
+            image = self.OPS[self.steps[i]['op']](self, i, self.steps[i], image, None)
+        return image
+
+    def _engine(self, step):
+        # Super-resolution engines upscale by their own fixed factor
+        engine = get_engine(step['engine'])
+        factor = step.get('factor', 2)
+        if factor != engine.scale:
+            raise ValueError(f"Engine {engine.name} upscales by {engine.scale}, not {factor}")
+        return engine
+
+    def _sharpen_kernel(self, step):
+        return _IDENTITY_KERNEL + step.get('amount', 1.0) * _HIGH_PASS_KERNEL
+
+    def _upscale_sharpen(self, i, image):
+        step = self.steps[i]
+        interpolation = INTERPOLATIONS[step.get('interpolation', 'lanczos')]
+        return tiling.upscale(image, int(step.get('factor', 2)), interpolation,
+                              self._sharpen_kernel(self.steps[i + 1]))
+
+    def _tone(self, i, step, image, faces):
+        return self._tones[i].apply(image)
+
+    def _denoise(self, i, step, image, faces):
+        return denoise(image, step.get('tier', 'quality'))
+
+    def _face(self, i, step, image, faces):
+        return smooth_faces(image, step.get('diameter', 9), step.get('sigma', 75), faces)
+
+    def _upscale(self, i, step, image, faces):
+        h, w = image.shape[:2]
+        factor = step.get('factor', 2)
+        if step.get('engine'):
+            return self._engine(step).upscale(image)
+        interpolation = INTERPOLATIONS[step.get('interpolation', 'lanczos')]
+        if float(factor).is_integer():
+            return tiling.upscale(image, int(factor), interpolation)
+        return cv2.resize(image, (round(w * factor), round(h * factor)), interpolation=interpolation)
+
+    def _sharpen(self, i, step, image, faces):
+        return cv2.filter2D(image, -1, self._sharpen_kernel(step))
+
+    OPS = {
+        'tone': _tone,
+        'denoise': _denoise,
+        'face': _face,
+        'upscale': _upscale,
+        'sharpen': _sharpen
+    }
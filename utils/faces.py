@@ -0,0 +1,91 @@
+import os
+import json
+import threading
+import cv2
+
+# Faces are detected on a copy of the crop at most this many pixels long
+FACE_DETECT_MAX_SIDE = int(os.getenv('FACE_DETECT_MAX_SIDE', '400'))
+
+# Smallest face width the HOG detector finds with one upsampling pass
+MIN_FACE_PX = 40
+
+# Sidecar file in every batch directory mapping crop names to face boxes
+FACES_INDEX = 'faces.json'
+
+_index_lock = threading.Lock()
+
+
+def _scale(shape, max_side):
+    long_side = max(shape[:2])
+    if not max_side or long_side <= max_side:
+        return 1.0
+    return max_side / float(long_side)
+
+
+def detect_faces(image, max_side=FACE_DETECT_MAX_SIDE, channel_order='bgr'):
+    """Find faces on a downscaled copy of an image and return their
+    (top, right, bottom, left) boxes in the image's own coordinates"""
+    import face_recognition
+
+    h, w = image.shape[:2]
+    scale = _scale(image.shape, max_side)
+    small = image
+    if scale < 1.0:
+        small = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))),
+                           interpolation=cv2.INTER_AREA)
+    if channel_order == 'bgr':
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+
+    boxes = []
+    for top, right, bottom, left in face_recognition.face_locations(small):
+        boxes.append([max(0, int(top / scale)), min(w, int(right / scale)),
+                      min(h, int(bottom / scale)), max(0, int(left / scale))])
+    return boxes
+
+
+def detectable(face_size, crop_shape, max_side=FACE_DETECT_MAX_SIDE):
+    """Whether a face `face_size` pixels wide (per the pose landmarks) could
+    be found in a crop of `crop_shape`; None means the size is unknown"""
+    if face_size is None:
+        return True
+    return face_size * _scale(crop_shape, max_side) >= MIN_FACE_PX
+
+
+def load_faces(batch_dir):
+    path = os.path.join(batch_dir, FACES_INDEX)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def record_faces(batch_dir, entries):
+    """Merge {crop name: boxes} into a batch's face index"""
+    if not entries:
+        return
+    path = os.path.join(batch_dir, FACES_INDEX)
+    with _index_lock:
+        faces = load_faces(batch_dir)
+        faces.update(entries)
+        # Write atomically so readers never see a partial file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(faces, f)
+        os.replace(tmp_path, path)
+
+
+def crop_faces(crop_path, image=None):
+    """Face boxes of an extracted crop, detected once and then read from
+    the batch's face index"""
+    batch_dir, name = os.path.split(crop_path)
+    faces = load_faces(batch_dir).get(name)
+    if faces is not None:
+        return faces
+
+    if image is None:
+        image = cv2.imread(crop_path)
+        if image is None:
+            raise ValueError(f"Could not read image: {crop_path}")
+    faces = detect_faces(image)
+    record_faces(batch_dir, {name: faces})
+    return faces
@@ -0,0 +1,164 @@
+import cv2
+import shutil
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+# x264/x265 default keyframe interval, used when the GOP cannot be probed
+DEFAULT_GOP_SIZE = 250
+
+# Extra cost of a seek, in decoded frames (decoder flush + demuxer seek)
+SEEK_OVERHEAD_FRAMES = 4
+
+# Relative cost of grab() compared to read(); grab still decodes but skips
+# the YUV->BGR conversion and the copy into a numpy array
+GRAB_COST = 0.8
+
+
+def probe_gop_size(video_path, max_packets=600):
+    """Estimate the keyframe interval of a video from its packet flags"""
+    ffprobe = shutil.which('ffprobe')
+    if not ffprobe or not video_path:
+        return None
+
+    try:
+        output = subprocess.run(
+            [ffprobe, '-v', 'error', '-select_streams', 'v:0',
+             '-show_entries', 'packet=flags', '-of', 'csv=p=0',
+             '-read_intervals', f'%+#{max_packets}', video_path],
+            capture_output=True, text=True, timeout=10, check=True
+        ).stdout
+    except (subprocess.SubprocessError, OSError) as e:
+        logger.warning(f"Could not probe GOP size of {video_path}: {str(e)}")
+        return None
+
+    keyframes = [i for i, flags in enumerate(output.split()) if flags.startswith('K')]
+    if len(keyframes) < 2:
+        return None
+    gaps = [b - a for a, b in zip(keyframes, keyframes[1:])]
+    return max(1, round(sum(gaps) / len(gaps)))
+
+
+def choose_strategy(interval, gop_size):
+    """Pick the cheapest way to reach every `interval`-th frame"""
+    if interval <= 1:
+        return 'read'
+
+    # A seek lands on the previous keyframe and decodes forward, on average
+    # half a GOP, while grabbing decodes every skipped frame
+    grab_cost = (interval - 1) * GRAB_COST
+    seek_cost = SEEK_OVERHEAD_FRAMES + (gop_size / 2.0) * GRAB_COST
+    return 'seek' if seek_cost < grab_cost else 'grab'
+
+
+class FrameSampler:
+    """Iterate over every `interval`-th frame of an opened capture, only fully
+    decoding the frames that are returned"""
+
+    STRATEGIES = ('auto', 'read', 'grab', 'seek')
+
+    def __init__(self, cap, interval, strategy='auto', video_path=None,
+                 start_frame=0, end_frame=None):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown sampling strategy: {strategy}")
+
+        self.cap = cap
+        self.interval = max(1, int(interval))
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.gop_size = None
+        # Containers may not know their length; 0 leaves positions unbounded
+        self.total_frames = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0))
+
+        if strategy in ('auto', 'seek'):
+            self.gop_size = probe_gop_size(video_path) or DEFAULT_GOP_SIZE
+        if strategy == 'auto':
+            strategy = choose_strategy(self.interval, self.gop_size)
+        self.strategy = strategy
+
+        self.position = start_frame
+        self._decoded_to = 0
+        self.sampled_frames = 0
+        self.decoded_frames = 0
+        self.grabbed_frames = 0
+        self.seeks = 0
+        logger.info(f"Sampling every {self.interval} frame(s) using '{self.strategy}' "
+                    f"(GOP size: {self.gop_size or 'unknown'})")
+
+    def _clamp(self, frame_index):
+        return min(frame_index, self.total_frames) if self.total_frames else frame_index
+
+    def _seek(self, frame_index):
+        if not self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index):
+            return False
+        self.seeks += 1
+        # The decoder restarts at the keyframe before the target and decodes
+        # up to it; estimated from the GOP size as the keyframes are not known
+        keyframe = frame_index - frame_index % (self.gop_size or DEFAULT_GOP_SIZE)
+        self.decoded_frames += max(0, self._clamp(frame_index) - keyframe)
+        self.position = frame_index
+        return True
+
+    def _at_end(self):
+        # A seek may have gone past the last frame; the frame count, which
+        # some containers report too low, bounds the position unless frames
+        # beyond it were decoded
+        self.position = max(self._decoded_to, self._clamp(self.position))
+
+    def _skip_to(self, frame_index):
+        """Advance the capture to `frame_index` without decoding the frames in between"""
+        if self.strategy == 'seek' and frame_index - self.position > 1:
+            if self._seek(frame_index):
+                return True
+            logger.warning("Seeking failed, falling back to grab()")
+            self.strategy = 'grab'
+
+        while self.position < frame_index:
+            if self.strategy == 'read':
+                ret, _ = self.cap.read()
+                self.decoded_frames += ret
+            else:
+                ret = self.cap.grab()
+                self.grabbed_frames += ret
+            if not ret:
+                return False
+            self.position += 1
+            self._decoded_to = self.position
+        return True
+
+    def __iter__(self):
+        if self.start_frame and not self._seek(self.start_frame):
+            # Containers without seek support are walked from the beginning
+            self.position = 0
+            if not self._skip_to(self.start_frame):
+                self._at_end()
+                return
+
+        # Keep the sampling grid aligned to absolute frame numbers so that
+        # segments of the same video pick the same frames as a single pass
+        target = -(-self.start_frame // self.interval) * self.interval
+        while self.end_frame is None or target < self.end_frame:
+            if not self._skip_to(target):
+                self._at_end()
+                break
+            ret, frame = self.cap.read()
+            if not ret:
+                self._at_end()
+                break
+            self.decoded_frames += 1
+            self.sampled_frames += 1
+            self.position += 1
+            self._decoded_to = self.position
+            yield target, frame
+            target += self.interval
+
+    def stats(self):
+        """Decode counters for the batch metadata"""
+        return {
+            'sampling_strategy': self.strategy,
+            'gop_size': self.gop_size,
+            'decoded_frames': self.decoded_frames,
+            'grabbed_frames': self.grabbed_frames,
+            'seeks': self.seeks
+        }
@@ -1,88 +1,180 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import cv2
 import numpy as np
-from PIL import Image, ImageEnhance
-import face_recognition
 import torch
 from torch import nn
 import torch.nn.functional as F
+from utils.async_writer import write_file
+from utils.enhance_kernels import FusedEnhancer
+from utils.denoise import denoise
+from utils.faces import detect_faces, crop_faces
+from utils.super_resolution import get_engine
+from utils.crop_batch import map_batched
+from utils.tiling import unsharp, tone_map
+
+logger = logging.getLogger(__name__)
+
+COLOR_ENHANCER = FusedEnhancer(contrast=1.1, saturation=1.2, channel_order='rgb')
+
+# Methods enhance_arrays runs on packed batches of small images
+BATCHED_METHODS = ('color', 'sharpen', 'hdr')
+
+# Cores batch_enhance may use across its worker processes
+ENHANCE_CORES = int(os.getenv('ENHANCE_CORES', str(os.cpu_count() or 1)))
+
+# Thread limits are process-wide; in-process batches take turns so that one
+# never restores the limits another has just set
+_in_process_lock = threading.Lock()
 
 class ImageEnhancer:
-    def __init__(self):
+    def __init__(self, denoise_tier='quality', sr_engine=None):
         # Initialize CUDA if available
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        # Default denoise tier, see utils.denoise; callers may override it per call
+        self.denoise_tier = denoise_tier
+        # Super-resolution engine name, see utils.super_resolution
+        self.sr_engine = sr_engine
+    
+    def warm_up(self):
+        """Run the default enhancement chain once on a small blank image"""
+        self.enhance_array(np.zeros((64, 64, 3), dtype=np.uint8))
         
-    def enhance_image(self, image_path, methods=None):
+    def enhance_image(self, image_path, methods=None, writer=None, denoise_tier=None):
         """Apply multiple enhancement methods to an image"""
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+        
+        # Face boxes of extracted crops are detected once and kept next to them
+        faces = crop_faces(image_path) if methods and 'face' in methods else None
+        enhanced_bytes = self.enhance_bytes(image_bytes, methods, denoise_tier, faces)
+        
+        # Save enhanced image with suffix
+        output_path = image_path.replace('.jpg', '_enhanced.jpg')
+        write_file(output_path, enhanced_bytes, writer)
+        return output_path
+    
+    def enhance_bytes(self, image_bytes, methods=None, denoise_tier=None, faces=None):
+        """Apply multiple enhancement methods to an encoded image and return
+        the encoded result, without touching the disk"""
+        img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Could not decode image")
+        
+        enhanced_img = self.enhance_array(img, methods, denoise_tier, faces)
+        
+        ok, encoded = cv2.imencode('.jpg', enhanced_img)
+        if not ok:
+            raise ValueError("Could not encode enhanced image")
+        return encoded.tobytes()
+    
+    def enhance_array(self, img, methods=None, denoise_tier=None, faces=None):
+        """Apply multiple enhancement methods to a BGR image array"""
         if methods is None:
             methods = ['color', 'denoise', 'sharpen']
-            
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"Could not load image: {image_path}")
         
         # Convert BGR to RGB
         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         
         enhanced_img = img.copy()
         for method in methods:
-            if method == 'color':
-                enhanced_img = self.enhance_color(enhanced_img)
-            elif method == 'denoise':
-                enhanced_img = self.reduce_noise(enhanced_img)
-            elif method == 'sharpen':
-                enhanced_img = self.sharpen_image(enhanced_img)
-            elif method == 'face':
-                enhanced_img = self.enhance_faces(enhanced_img)
-            elif method == 'super_res':
-                enhanced_img = self.super_resolution(enhanced_img)
-            elif method == 'hdr':
-                enhanced_img = self.apply_hdr_effect(enhanced_img)
+            enhanced_img, faces = self._apply_method(enhanced_img, method, denoise_tier, faces)
         
         # Convert back to BGR for saving
-        enhanced_img = cv2.cvtColor(enhanced_img, cv2.COLOR_RGB2BGR)
-        
-        # Save enhanced image with suffix
-        output_path = image_path.replace('.jpg', '_enhanced.jpg')
-        cv2.imwrite(output_path, enhanced_img)
-        return output_path
+        return cv2.cvtColor(enhanced_img, cv2.COLOR_RGB2BGR)
     
-    def enhance_color(self, img):
-        """Enhance color saturation and contrast"""
-        # Convert to PIL Image for better color enhancement
-        pil_img = Image.fromarray(img)
+    def enhance_arrays(self, images, methods=None, denoise_tier=None):
+        """Apply multiple enhancement methods to many BGR image arrays.
         
-        # Enhance color saturation
-        enhancer = ImageEnhance.Color(pil_img)
-        pil_img = enhancer.enhance(1.2)  # Increase saturation by 20%
+        Consecutive 'color', 'sharpen' and 'hdr' steps process the small
+        images packed together (see utils.crop_batch); results match
+        enhance_array.
+        """
+        if methods is None:
+            methods = ['color', 'denoise', 'sharpen']
         
-        # Enhance contrast
-        enhancer = ImageEnhance.Contrast(pil_img)
-        pil_img = enhancer.enhance(1.1)  # Increase contrast by 10%
+        images = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in images]
+        i = 0
+        while i < len(methods):
+            end = i
+            while end < len(methods) and methods[end] in BATCHED_METHODS:
+                end += 1
+            if end > i:
+                run = methods[i:end]
+                images = map_batched(images, lambda batch: self._batch_methods(batch, run),
+                                     lambda img: self._single_methods(img, run))
+                i = end
+            else:
+                images = [self._apply_method(img, methods[i], denoise_tier, None)[0] for img in images]
+                i += 1
         
-        # Convert back to numpy array
-        return np.array(pil_img)
+        return [cv2.cvtColor(img, cv2.COLOR_RGB2BGR) for img in images]
     
-    def reduce_noise(self, img):
+    def _batch_methods(self, batch, methods):
+        for method in methods:
+            if method == 'color':
+                batch.tone(COLOR_ENHANCER)
+            elif method == 'sharpen':
+                batch.unsharp(1.5, 3)
+            elif method == 'hdr':
+                batch.hdr('rgb')
+        return batch.unpack()
+    
+    def _single_methods(self, img, methods):
+        for method in methods:
+            img, _ = self._apply_method(img, method, None, None)
+        return img
+    
+    def _apply_method(self, img, method, denoise_tier, faces):
+        """Apply one enhancement method to an RGB image; returns the image
+        and the face boxes in its coordinates"""
+        if method == 'color':
+            img = self.enhance_color(img)
+        elif method == 'denoise':
+            img = self.reduce_noise(img, denoise_tier)
+        elif method == 'sharpen':
+            img = self.sharpen_image(img)
+        elif method == 'face':
+            img = self.enhance_faces(img, denoise_tier, faces)
+        elif method == 'super_res':
+            img = self.super_resolution(img)
+            if faces:
+                scale = get_engine(self.sr_engine).scale
+                faces = [[coord * scale for coord in box] for box in faces]
+        elif method == 'hdr':
+            img = self.apply_hdr_effect(img)
+        return img, faces
+    
+    def enhance_color(self, img):
+        """Enhance color saturation and contrast"""
+        # Saturation +20% and contrast +10% as a single colour matrix
+        return COLOR_ENHANCER.apply(img)
+    
+    def reduce_noise(self, img, tier=None):
         """Apply advanced noise reduction"""
-        # Non-local means denoising
-        return cv2.fastNlMeansDenoisingColored(img, None, 10, 10, 7, 21)
+        return denoise(img, tier or self.denoise_tier, channel_order='rgb')
     
     def sharpen_image(self, img):
         """Apply adaptive sharpening"""
-        blurred = cv2.GaussianBlur(img, (0, 0), 3)
-        return cv2.addWeighted(img, 1.5, blurred, -0.5, 0)
+        # Subtract a Gaussian blur, strip by strip for large images
+        return unsharp(img, 1.5, 3)
     
-    def enhance_faces(self, img):
+    def enhance_faces(self, img, denoise_tier=None, faces=None):
         """Enhance detected faces in the image"""
-        # Find face locations
-        face_locations = face_recognition.face_locations(img)
+        # Find face locations on a downscaled copy unless already known
+        if faces is None:
+            faces = detect_faces(img, channel_order='rgb')
         
-        for top, right, bottom, left in face_locations:
+        for top, right, bottom, left in faces:
             # Extract face region
             face = img[top:bottom, left:right]
             
             # Apply face-specific enhancements
-            face = self.reduce_noise(face)  # Reduce noise
+            face = self.reduce_noise(face, denoise_tier)  # Reduce noise
             face = self.enhance_color(face)  # Enhance colors
             
             # Smooth skin while preserving details
@@ -94,50 +186,107 @@ class ImageEnhancer:
         return img
     
     def super_resolution(self, img):
-        """Apply super-resolution using bicubic interpolation"""
-        # Scale up the image by 2x
-        height, width = img.shape[:2]
-        scaled = cv2.resize(img, (width*2, height*2), interpolation=cv2.INTER_CUBIC)
-        
-        # Scale back down to original size with enhanced details
-        return cv2.resize(scaled, (width, height), interpolation=cv2.INTER_AREA)
+        """Upscale an RGB image with the configured super-resolution engine"""
+        bgr = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        return cv2.cvtColor(get_engine(self.sr_engine).upscale(bgr), cv2.COLOR_BGR2RGB)
     
     def apply_hdr_effect(self, img):
         """Apply HDR-like effect to the image"""
-        # Convert to float32
-        img_float = img.astype(np.float32) / 255.0
-        
-        # Apply local tone mapping
-        # Split into luminance and color
-        luminance = cv2.cvtColor(img_float, cv2.COLOR_RGB2LAB)[:,:,0]
+        # Local tone mapping of the luminance, strip by strip for large
+        # images since it works on several float32 copies
+        return tone_map(img, channel_order='rgb')
+
+    def batch_enhance(self, image_paths, methods=None, workers=None, progress=None, denoise_tier=None):
+        """Enhance many images on a process pool.
         
-        # Apply bilateral filter to create base layer
-        base = cv2.bilateralFilter(luminance, 9, 0.1, 7)
-        detail = luminance - base
+        Uses at most `workers` processes (the ENHANCE_CORES budget by
+        default), each limited to its share of the budget for OpenCV and
+        torch threads. `progress` is called with a record for every image as
+        it completes. Returns one record per input path, in input order, with
+        its output path or error and the time spent on it.
+        """
+        image_paths = list(image_paths)
+        total = len(image_paths)
+        if workers is None:
+            workers = ENHANCE_CORES
+        workers = max(1, min(workers, total))
+        threads = max(1, ENHANCE_CORES // workers)
+        denoise_tier = denoise_tier or self.denoise_tier
         
-        # Enhance local contrast
-        enhanced_base = np.clip((base - 0.5) * 1.2 + 0.5, 0, 1)
-        enhanced_luminance = enhanced_base + detail
+        records = [None] * total
+        done = 0
         
-        # Reconstruct image
-        img_float = cv2.cvtColor(img, cv2.COLOR_RGB2LAB).astype(np.float32)
-        img_float[:,:,0] = enhanced_luminance * 255
-        enhanced = cv2.cvtColor(img_float.astype(np.uint8), cv2.COLOR_LAB2RGB)
+        def collect(index, record):
+            nonlocal done
+            done += 1
+            records[index] = record
+            record.update({'index': index, 'done': done, 'total': total})
+            if record['error']:
+                logger.error(f"Error enhancing {record['path']}: {record['error']}")
+            if progress is not None:
+                progress(dict(record))
         
-        return enhanced
-
-    def batch_enhance(self, image_paths, methods=None):
-        """Enhance multiple images with progress tracking"""
-        enhanced_paths = []
-        total = len(image_paths)
+        if workers == 1:
+            # Small batches are not worth starting processes for; this
+            # process serves other requests too, so put its limits back after
+            with _in_process_lock:
+                previous = _limit_threads(threads)
+                try:
+                    for index, path in enumerate(image_paths):
+                        collect(index, _enhance_path(self, path, methods, denoise_tier))
+                finally:
+                    _limit_threads(*previous)
+            return records
         
-        for i, path in enumerate(image_paths, 1):
-            try:
-                enhanced_path = self.enhance_image(path, methods)
-                enhanced_paths.append(enhanced_path)
-                print(f"Enhanced {i}/{total}: {path}")
-            except Exception as e:
-                print(f"Error enhancing {path}: {str(e)}")
-                continue
+        # Spawn so that no torch or OpenCV thread pools are inherited half-initialised
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_batch_worker,
+                                 initargs=(denoise_tier, self.sr_engine, threads)) as pool:
+            futures = {
+                pool.submit(_enhance_batch_item, path, methods): index
+                for index, path in enumerate(image_paths)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    # The worker itself died; the image may be fine
+                    record = {'path': image_paths[index], 'output': None,
+                              'error': f"{type(e).__name__}: {str(e)}", 'seconds': None}
+                collect(index, record)
         
-        return enhanced_paths
+        return records
+
+
+def _limit_threads(threads, torch_threads=None):
+    """Cap the intra-op threads of OpenCV and torch (to `threads` as well,
+    unless given) in this process; returns the previous limits"""
+    previous = cv2.getNumThreads(), torch.get_num_threads()
+    cv2.setNumThreads(threads)
+    torch.set_num_threads(threads if torch_threads is None else torch_threads)
+    return previous
+
+
+def _enhance_path(enhancer, path, methods, denoise_tier):
+    start = time.perf_counter()
+    record = {'path': path, 'output': None, 'error': None}
+    try:
+        record['output'] = enhancer.enhance_image(path, methods, denoise_tier=denoise_tier)
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {str(e)}"
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    return record
+
+
+_batch_enhancer = None
+
+
+def _init_batch_worker(denoise_tier, sr_engine, threads):
+    global _batch_enhancer
+    _limit_threads(threads)
+    _batch_enhancer = ImageEnhancer(denoise_tier, sr_engine)
+
+
+def _enhance_batch_item(path, methods):
+    return _enhance_path(_batch_enhancer, path, methods, _batch_enhancer.denoise_tier)
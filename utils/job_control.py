@@ -0,0 +1,50 @@
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How often a running job asks whether it has been cancelled; answering may
+# touch the filesystem, unlike the per-frame checks of the time budget
+CANCEL_POLL_INTERVAL = 1.0
+
+
+class Cancelled(Exception):
+    """Raised inside a job that was asked to stop"""
+
+
+class BudgetExceeded(Cancelled):
+    """Raised inside a job that ran out of wall-clock time"""
+
+
+class JobControl:
+    """Cooperative stop signal of a long-running job.
+
+    The job calls check() between units of work, e.g. every decoded frame;
+    it raises Cancelled once `is_cancelled()` returns true, polled at most
+    every `poll_interval` seconds, and BudgetExceeded once the job has run
+    for more than `budget` seconds, including time spent before a resume.
+    """
+
+    def __init__(self, budget=None, is_cancelled=None, poll_interval=CANCEL_POLL_INTERVAL):
+        self.budget = budget or None
+        self.is_cancelled = is_cancelled
+        self.poll_interval = poll_interval
+        self._started = time.monotonic()
+        self._spent = 0.0
+        self._polled = self._started
+
+    def resume(self, spent):
+        """Count `spent` seconds of an earlier, interrupted run against the budget"""
+        self._spent = spent
+
+    def elapsed(self):
+        return self._spent + time.monotonic() - self._started
+
+    def check(self):
+        now = time.monotonic()
+        if self.budget is not None and self._spent + now - self._started > self.budget:
+            raise BudgetExceeded(f"Time budget of {self.budget:g}s exceeded")
+        if self.is_cancelled is not None and now - self._polled >= self.poll_interval:
+            self._polled = now
+            if self.is_cancelled():
+                raise Cancelled("Cancelled by request")
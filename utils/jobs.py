@@ -0,0 +1,495 @@
+import os
+import abc
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from utils.scheduler import Scheduler, QueueFull, NORMAL, HIGH, percentile
+from utils.job_control import JobControl, Cancelled, BudgetExceeded
+
+logger = logging.getLogger(__name__)
+
+# Where jobs run: 'local' runs them on threads of the web process and keeps
+# their state in SQLite, 'celery' sends them to Celery workers
+JOB_BACKEND = os.getenv('JOB_BACKEND', 'local')
+JOB_DB = os.getenv('JOB_DB', os.path.join('cache', 'jobs.sqlite3'))
+# Worker threads of the local backend; 0 sizes them from the scheduler
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '0'))
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', CELERY_BROKER_URL)
+# Wall-clock seconds an extraction job may run, across resumes; 0 for no limit
+JOB_TIME_BUDGET = float(os.getenv('JOB_TIME_BUDGET', '0'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# How often idle local workers look for jobs submitted by other processes
+_POLL_INTERVAL = 1.0
+
+# Window of started jobs the wait-time percentiles are computed over
+_STATS_WINDOW = 3600
+
+
+_current = threading.local()
+
+
+def current_job_id():
+    """ID of the job running in this thread, or None outside of jobs"""
+    job_id = getattr(_current, 'job_id', None)
+    if job_id is None and JOB_BACKEND == 'celery':
+        from celery import current_task
+        job_id = current_task.request.id if current_task else None
+    return job_id
+
+
+def job_slots(scheduler=None):
+    """Jobs one process runs at once: JOB_WORKERS, or the scheduler's
+    core-based capacity"""
+    return JOB_WORKERS or (scheduler or Scheduler()).max_capacity()
+
+
+def extract_video(video_path, frame_rate=10, confidence=0.5, remove=False, time_budget=None):
+    """Extract human crops from a video with a pooled VideoProcessor and
+    return their records; with `remove` the video is deleted afterwards.
+    Inside a job, progress and crops are published under the job's ID, the
+    job can be cancelled, stops after `time_budget` seconds (JOB_TIME_BUDGET
+    by default) and resumes from its checkpoint when run again after an
+    interruption."""
+    from utils.model_pool import video_processors
+    from utils.progress import Progress, get_store
+    job_id = current_job_id()
+    progress = control = None
+    if job_id:
+        store = get_store()
+        progress = Progress(job_id, store)
+        control = JobControl(budget=JOB_TIME_BUDGET if time_budget is None else time_budget,
+                             is_cancelled=lambda: store.cancel_requested(job_id))
+    try:
+        with video_processors().checkout() as processor:
+            return [detection.to_dict(include_base64=False)
+                    for detection in processor.iter_detections(video_path, frame_rate, confidence,
+                                                               progress=progress, control=control,
+                                                               resume_key=job_id)]
+    finally:
+        if remove and os.path.exists(video_path):
+            os.remove(video_path)
+
+
+# Functions jobs may run, by name; arguments and results must be JSON
+TASKS = {
+    'extract_video': extract_video
+}
+
+
+class JobBackend(abc.ABC):
+    """Runs named tasks in the background.
+
+    submit() returns a job ID at once, or raises QueueFull when admission
+    control refuses the job; status() reports the job's state (queued,
+    running, completed, failed or cancelled) and result() the task's return
+    value once it has completed. cancel() drops a queued job and asks a
+    running one to stop, which it does at its next check of JobControl.
+    """
+
+    def __init__(self, tasks=None, scheduler=None):
+        self.tasks = TASKS if tasks is None else tasks
+        self.scheduler = scheduler or Scheduler()
+        self.rejected = 0
+
+    def _check(self, task):
+        if task not in self.tasks:
+            raise ValueError(f"Unknown job task: {task}")
+
+    @abc.abstractmethod
+    def submit(self, task, user_id=None, priority=NORMAL, **kwargs):
+        pass
+
+    @abc.abstractmethod
+    def status(self, job_id):
+        pass
+
+    @abc.abstractmethod
+    def result(self, job_id):
+        pass
+
+    @abc.abstractmethod
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it had already finished"""
+
+    @abc.abstractmethod
+    def stats(self):
+        """Queue depth, running jobs and wait-time percentiles"""
+
+
+class LocalBackend(JobBackend):
+    """Jobs run on worker threads of this process, with their state in a
+    SQLite database.
+
+    The scheduler picks which queued job runs next and how many run at
+    once across all processes sharing the database, which claim jobs
+    atomically. Jobs left running by a process that has exited are queued
+    again when the backend starts. `workers` threads are started, as many
+    as the scheduler's core-based capacity when None; with 0 nothing runs
+    in the background and run_next() executes queued jobs, which suits
+    scripts and tests.
+    """
+
+    def __init__(self, path=JOB_DB, workers=None, tasks=None, scheduler=None):
+        super().__init__(tasks, scheduler)
+        if workers is None:
+            workers = job_slots(self.scheduler)
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit; transactions are opened explicitly where needed
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        with self._lock:
+            if path != ':memory:':
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    task TEXT NOT NULL,
+                    args TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    owner INTEGER,
+                    user_id TEXT,
+                    priority INTEGER NOT NULL DEFAULT 1,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            # Databases created before jobs were scheduled per user
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+            if 'user_id' not in columns:
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN user_id TEXT")
+                self._conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 1")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._requeue_orphans()
+
+        self._threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _requeue_orphans(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT id, owner FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+            for job_id, owner in rows:
+                if owner is not None and owner != os.getpid() and _alive(owner):
+                    continue
+                logger.info(f"Requeueing job {job_id} interrupted by a restart")
+                self._conn.execute("UPDATE jobs SET status = ?, started_at = NULL, owner = NULL WHERE id = ?",
+                                   (QUEUED, job_id))
+
+    def _transaction(self, func):
+        """Run func() in a write transaction, serialised across processes"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def submit(self, task, user_id=None, priority=NORMAL, **kwargs):
+        self._check(task)
+        job_id = uuid.uuid4().hex
+        user_id = None if user_id is None else str(user_id)
+
+        def enqueue():
+            queued, queued_by_user = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(user_id IS ?), 0) FROM jobs WHERE status = ?", (user_id, QUEUED)
+            ).fetchone()
+            self.scheduler.admit(user_id, queued, queued_by_user)
+            self._conn.execute(
+                "INSERT INTO jobs (id, task, args, status, user_id, priority, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, task, json.dumps(kwargs), QUEUED, user_id, priority, time.time())
+            )
+
+        try:
+            self._transaction(enqueue)
+        except QueueFull as e:
+            self.rejected += 1
+            logger.warning(f"Rejected {task} job of user {user_id}: {str(e)}")
+            raise
+        logger.info(f"Queued job {job_id} ({task}, user {user_id}, priority {priority})")
+        self._wake.set()
+        return job_id
+
+    def _claim(self):
+        """Mark the job the scheduler picks as running and return it, or
+        None when nothing is queued or no capacity is free"""
+        def claim():
+            running_by_user, last_started_by_user = {}, {}
+            for user_id, running, last_started in self._conn.execute(
+                "SELECT user_id, SUM(status = ?), MAX(started_at) FROM jobs "
+                "WHERE status = ? OR started_at IS NOT NULL GROUP BY user_id", (RUNNING, RUNNING)
+            ):
+                running_by_user[user_id] = running
+                last_started_by_user[user_id] = last_started
+            if sum(running_by_user.values()) >= self.scheduler.capacity(sum(running_by_user.values())):
+                return None
+            queued = [
+                dict(zip(('id', 'task', 'args', 'user_id', 'priority', 'created_at'), row))
+                for row in self._conn.execute(
+                    "SELECT id, task, args, user_id, priority, created_at FROM jobs WHERE status = ?", (QUEUED,)
+                )
+            ]
+            job = self.scheduler.pick(queued, running_by_user, last_started_by_user)
+            if job is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = ?, started_at = ?, owner = ? WHERE id = ?",
+                               (RUNNING, time.time(), os.getpid(), job['id']))
+            return job['id'], job['task'], job['args']
+
+        return self._transaction(claim)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                               (status, result, error, time.time(), job_id))
+        # A slot is free, let a waiting worker take the next job
+        self._wake.set()
+
+    def run_next(self):
+        """Run the oldest queued job in this thread; returns False if there was none"""
+        row = self._claim()
+        if row is None:
+            return False
+
+        job_id, task, args = row
+        logger.info(f"Running job {job_id} ({task})")
+        _current.job_id = job_id
+        try:
+            self._check(task)
+            result = self.tasks[task](**json.loads(args))
+            self._finish(job_id, COMPLETED, result=json.dumps(result))
+            logger.info(f"Job {job_id} completed")
+        except BudgetExceeded as e:
+            logger.warning(f"Job {job_id} stopped: {str(e)}")
+            self._finish(job_id, FAILED, error=str(e))
+        except Cancelled as e:
+            logger.info(f"Job {job_id} cancelled")
+            self._finish(job_id, CANCELLED, error=str(e))
+        except Exception as e:
+            logger.error(f"Error in job {job_id}: {str(e)}")
+            self._finish(job_id, FAILED, error=str(e))
+        finally:
+            _current.job_id = None
+        return True
+
+    def _work(self):
+        while True:
+            try:
+                if self.run_next():
+                    continue
+            except Exception as e:
+                logger.error(f"Error in job worker: {str(e)}")
+            self._wake.wait(_POLL_INTERVAL)
+            self._wake.clear()
+
+    def status(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, task, status, error, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ('id', 'task', 'status', 'error', 'created_at', 'started_at', 'finished_at')
+        return dict(zip(keys, row))
+
+    def result(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT status, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row[0] != COMPLETED:
+            return None
+        return json.loads(row[1])
+
+    def cancel(self, job_id):
+        def mark():
+            row = self._conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None and row[0] == QUEUED:
+                self._conn.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                                   (CANCELLED, "Cancelled by request", time.time(), job_id))
+            return row and row[0]
+
+        status = self._transaction(mark)
+        if status == RUNNING:
+            # The job may run in another process sharing the database
+            from utils.progress import get_store
+            get_store().request_cancel(job_id)
+        if status in (QUEUED, RUNNING):
+            logger.info(f"Cancelling job {job_id} ({status})")
+            return True
+        return False
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE status IN (?, ?) GROUP BY status", (QUEUED, RUNNING)
+            ).fetchall())
+            waits = [row[0] for row in self._conn.execute(
+                "SELECT started_at - created_at FROM jobs WHERE started_at >= ?", (now - _STATS_WINDOW,)
+            )]
+            # Jobs still waiting count with their wait so far
+            waits += [row[0] for row in self._conn.execute(
+                "SELECT ? - created_at FROM jobs WHERE status = ?", (now, QUEUED)
+            )]
+        running = counts.get(RUNNING, 0)
+        return {
+            'queued': counts.get(QUEUED, 0),
+            'running': running,
+            'capacity': self.scheduler.capacity(running),
+            'rejected': self.rejected,
+            'wait_p50': percentile(waits, 50),
+            'wait_p90': percentile(waits, 90),
+            'wait_p99': percentile(waits, 99)
+        }
+
+
+class CeleryBackend(JobBackend):
+    """Jobs are sent through a broker (Redis by default) to Celery workers,
+    started with `JOB_BACKEND=celery celery -A utils.jobs worker`.
+
+    Workers must see the same filesystem as the web process, since videos
+    are passed by path and crops are written to extracted/. Job priorities
+    are passed to the broker and each worker runs as many jobs at once as
+    the scheduler's core-based capacity; fair share and admission control
+    need to see the whole queue and only apply to the local backend.
+    """
+
+    STATES = {
+        'PENDING': QUEUED,
+        'RECEIVED': QUEUED,
+        'RETRY': QUEUED,
+        'STARTED': RUNNING,
+        'SUCCESS': COMPLETED,
+        'FAILURE': FAILED,
+        'REVOKED': CANCELLED
+    }
+
+    def __init__(self, broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND, tasks=None, scheduler=None):
+        super().__init__(tasks, scheduler)
+        from celery import Celery
+
+        self.app = Celery('video_extractor', broker=broker, backend=backend)
+        self.app.conf.update(
+            task_serializer='json',
+            result_serializer='json',
+            accept_content=['json'],
+            # Report 'running' rather than 'queued' once a worker picks a job up
+            task_track_started=True,
+            result_extended=True,
+            # Extraction jobs are long; do not hand a worker more than it runs
+            worker_prefetch_multiplier=1,
+            task_acks_late=True,
+            # Redeliver jobs of a worker that died, they resume from their checkpoint
+            task_reject_on_worker_lost=True,
+            worker_concurrency=self.scheduler.max_capacity(),
+            # Let the Redis transport order messages by priority
+            broker_transport_options={'priority_steps': list(range(10)), 'queue_order_strategy': 'priority'}
+        )
+        for name, func in self.tasks.items():
+            self.app.task(name=f"jobs.{name}")(func)
+
+    def submit(self, task, user_id=None, priority=NORMAL, **kwargs):
+        self._check(task)
+        # Redis serves priority 0 first
+        job_id = self.app.send_task(f"jobs.{task}", kwargs=kwargs, priority=3 * (HIGH - priority)).id
+        logger.info(f"Queued job {job_id} ({task}, user {user_id}, priority {priority})")
+        return job_id
+
+    def status(self, job_id):
+        # Celery cannot tell unknown jobs from queued ones; both are PENDING
+        result = self.app.AsyncResult(job_id)
+        status = self.STATES.get(result.state, QUEUED)
+        if status == FAILED and isinstance(result.result, Cancelled) and not isinstance(result.result,
+                                                                                       BudgetExceeded):
+            status = CANCELLED
+        finished = result.date_done.timestamp() if status in (COMPLETED, FAILED) and result.date_done else None
+        return {
+            'id': job_id,
+            'task': (result.name or '').replace('jobs.', '', 1) or None,
+            'status': status,
+            'error': str(result.result) if status in (FAILED, CANCELLED) else None,
+            'created_at': None,
+            'started_at': None,
+            'finished_at': finished
+        }
+
+    def result(self, job_id):
+        result = self.app.AsyncResult(job_id)
+        return result.result if result.successful() else None
+
+    def cancel(self, job_id):
+        from utils.progress import get_store
+        if self.status(job_id)['status'] in (COMPLETED, FAILED, CANCELLED):
+            return False
+        # Revoking only keeps a worker from starting the job; a running job
+        # stops on the request left in the shared progress directory
+        self.app.control.revoke(job_id)
+        get_store().request_cancel(job_id)
+        logger.info(f"Cancelling job {job_id}")
+        return True
+
+    def stats(self):
+        # The broker does not report queue depth or wait times cheaply
+        return {
+            'queued': None,
+            'running': None,
+            'capacity': self.scheduler.max_capacity(),
+            'rejected': self.rejected,
+            'wait_p50': None,
+            'wait_p90': None,
+            'wait_p99': None
+        }
+
+
+BACKENDS = {
+    'local': LocalBackend,
+    'celery': CeleryBackend
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Process-wide job backend selected by JOB_BACKEND"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if JOB_BACKEND not in BACKENDS:
+                raise ValueError(f"Unknown job backend: {JOB_BACKEND}")
+            _backend = BACKENDS[JOB_BACKEND]()
+        return _backend
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+if JOB_BACKEND == 'celery':
+    # Application object the `celery -A utils.jobs worker` command looks for
+    celery = get_backend().app
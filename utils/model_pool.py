@@ -0,0 +1,161 @@
+import os
+import queue
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Instances per pool and per process (video processors: at least one per job
+# the process runs at once), and uses before an instance is rebuilt
+POOL_SIZE = int(os.getenv('MODEL_POOL_SIZE', '2'))
+MAX_USES = int(os.getenv('MODEL_MAX_USES', '100'))
+CHECKOUT_TIMEOUT = float(os.getenv('MODEL_CHECKOUT_TIMEOUT', '300'))
+
+_POLL_INTERVAL = 0.5
+
+
+class ModelPool:
+    """Process-wide pool of expensive model instances.
+
+    Instances are built lazily up to `size`, warmed up once, handed out with
+    checkout() and recycled after `max_uses` checkouts or when they fail
+    their health check after an error.
+    """
+
+    def __init__(self, factory, size=POOL_SIZE, max_uses=MAX_USES, timeout=CHECKOUT_TIMEOUT, name='model'):
+        self.factory = factory
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.timeout = timeout
+        self.name = name
+        # Last in, first out keeps the most recently used instances hot
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._uses = {}
+        self._created = 0
+        self._recycled = 0
+
+    def _create(self):
+        logger.info(f"Loading {self.name} instance {self._created}/{self.size}")
+        instance = self.factory()
+        if hasattr(instance, 'warm_up'):
+            instance.warm_up()
+        with self._lock:
+            self._uses[id(instance)] = 0
+        return instance
+
+    def _reserve(self):
+        """Claim a slot for a new instance if the pool is not full"""
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return True
+            return False
+
+    def _build(self):
+        try:
+            return self._create()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            if self._reserve():
+                return self._build()
+
+            # Wake up now and then, a recycled instance frees a slot
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RuntimeError(f"No {self.name} instance became available within {self.timeout}s")
+            try:
+                return self._idle.get(timeout=min(remaining, _POLL_INTERVAL))
+            except queue.Empty:
+                continue
+
+    def _healthy(self, instance):
+        check = getattr(instance, 'is_healthy', None)
+        try:
+            return check() if check else True
+        except Exception as e:
+            logger.warning(f"Health check of {self.name} instance failed: {str(e)}")
+            return False
+
+    def _discard(self, instance):
+        with self._lock:
+            self._uses.pop(id(instance), None)
+            self._created -= 1
+            self._recycled += 1
+        try:
+            if hasattr(instance, 'close'):
+                instance.close()
+        except Exception as e:
+            logger.warning(f"Error closing {self.name} instance: {str(e)}")
+
+    def _release(self, instance, failed):
+        with self._lock:
+            self._uses[id(instance)] += 1
+            worn_out = self._uses[id(instance)] >= self.max_uses
+
+        if not worn_out and not (failed and not self._healthy(instance)):
+            self._idle.put(instance)
+            return
+
+        logger.info(f"Recycling {self.name} instance")
+        self._discard(instance)
+        # Build the replacement now so the next checkout gets a warm instance
+        if self._reserve():
+            try:
+                self._idle.put(self._build())
+            except Exception as e:
+                logger.error(f"Error replacing {self.name} instance: {str(e)}")
+
+    @contextmanager
+    def checkout(self):
+        """Borrow an instance for the duration of a with block"""
+        instance = self._acquire()
+        failed = False
+        try:
+            yield instance
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._release(instance, failed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'loaded': self._created,
+                'idle': self._idle.qsize(),
+                'recycled': self._recycled
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name, factory, **kwargs):
+    """Return the pool called `name`, creating it on first use"""
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = ModelPool(factory, name=name, **kwargs)
+        return _pools[name]
+
+
+def video_processors():
+    from utils.video_processor import VideoProcessor
+    from utils.jobs import job_slots
+    # Every job that runs at once holds a processor for its whole length
+    return get_pool('video_processor', VideoProcessor, size=max(POOL_SIZE, job_slots()))
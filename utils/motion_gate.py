@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+
+# Width of the grayscale thumbnail frames are compared on
+THUMBNAIL_WIDTH = 64
+
+
+class MotionGate:
+    """Decide whether a sampled frame differs enough from the last analyzed
+    one to be worth running pose detection on.
+
+    Frames are compared as tiny grayscale thumbnails; the score is the mean
+    absolute pixel difference scaled to [0, 1]. `threshold` is the score
+    below which a frame counts as static. In 'reuse' mode a static frame is
+    cropped with the previous detection's bounding box, in 'skip' mode it
+    produces no crop at all.
+    """
+
+    MODES = ('skip', 'reuse')
+
+    def __init__(self, threshold=0.02, mode='skip'):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown motion gate mode: {mode}")
+        self.threshold = threshold
+        self.mode = mode
+        self.reference = None
+        self.current = None
+        self.last_result = None
+        self.checked_frames = 0
+        self.static_frames = 0
+
+    def _thumbnail(self, frame):
+        h, w = frame.shape[:2]
+        size = (THUMBNAIL_WIDTH, max(1, round(h * THUMBNAIL_WIDTH / w)))
+        # Shrink first so the colour conversion only touches a few thousand pixels
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+    def is_static(self, frame):
+        """Compare `frame` with the last analyzed frame"""
+        self.checked_frames += 1
+        self.current = self._thumbnail(frame)
+        if self.reference is None:
+            return False
+        score = float(np.abs(self.current - self.reference).mean()) / 255.0
+        if score < self.threshold:
+            self.static_frames += 1
+            return True
+        return False
+
+    def analyzed(self, result):
+        """Make the frame last passed to is_static() the new reference, along
+        with its detection result"""
+        self.reference = self.current
+        self.last_result = result
+
+    def stats(self):
+        return {
+            'threshold': self.threshold,
+            'mode': self.mode,
+            'checked_frames': self.checked_frames,
+            'static_frames': self.static_frames,
+            'skip_rate': round(self.static_frames / self.checked_frames, 3) if self.checked_frames else 0.0
+        }
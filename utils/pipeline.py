@@ -0,0 +1,216 @@
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Marker for items a stage has dropped; it still travels down the pipeline so
+# that ordered output can advance past it
+_SKIP = object()
+_DONE = object()
+
+# How often blocked workers wake up to check whether the pipeline was stopped
+_POLL_INTERVAL = 0.1
+
+
+class Stage:
+    """One step of a Pipeline, run by `workers` threads.
+
+    `func` takes an item and returns the item for the next stage, or None to
+    drop it. Stages that keep state between items (e.g. a tracking pose
+    model) must use a single worker.
+    """
+
+    def __init__(self, name, func, workers=1):
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker")
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+class _StageStats:
+    def __init__(self, workers):
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self.queue_depth = 0
+        self.lock = threading.Lock()
+
+    def add(self, busy, starved, blocked, queue_depth):
+        with self.lock:
+            self.items += 1
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+            self.queue_depth += queue_depth
+
+    def as_dict(self, elapsed):
+        capacity = max(elapsed * self.workers, 1e-9)
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            # Share of worker time spent doing work, waiting for input and
+            # waiting for room downstream; the bottleneck has the highest
+            # occupancy and its upstream stages show blocked time
+            'occupancy': round(self.busy / capacity, 3),
+            'starved': round(self.starved / capacity, 3),
+            'blocked': round(self.blocked / capacity, 3),
+            'avg_queue_depth': round(self.queue_depth / self.items, 2) if self.items else 0.0,
+            'ms_per_item': round(1000 * self.busy / self.items, 2) if self.items else 0.0
+        }
+
+
+class Pipeline:
+    """Run a source iterator through stages on threads connected by bounded
+    queues, so that stages overlap while memory stays bounded.
+
+    Iterating over `run()` yields the output of the last stage, in source
+    order when `ordered` is set.
+    """
+
+    def __init__(self, stages, queue_size=4, ordered=True, source_name='source'):
+        self.stages = list(stages)
+        self.queue_size = queue_size
+        self.ordered = ordered
+        self.source_name = source_name
+        self._stats = {}
+        self._elapsed = 0.0
+
+    def _put(self, q, item, stop):
+        """Put with backpressure, returning the time spent blocked"""
+        start = time.perf_counter()
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        return time.perf_counter() - start
+
+    def _get(self, q, stop):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _feed(self, source, out_queue, downstream_workers, stats, stop, errors):
+        try:
+            iterator = iter(source)
+            seq = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                busy = time.perf_counter() - start
+                blocked = self._put(out_queue, (seq, item), stop)
+                stats.add(busy, 0.0, blocked, 0)
+                seq += 1
+        except Exception as e:
+            logger.error(f"Error in pipeline stage {self.source_name}: {str(e)}")
+            errors.append(e)
+            stop.set()
+        finally:
+            for _ in range(downstream_workers):
+                self._put(out_queue, _DONE, stop)
+
+    def _work(self, stage, in_queue, out_queue, downstream_workers, remaining, stats, stop, errors):
+        try:
+            while True:
+                start = time.perf_counter()
+                entry = self._get(in_queue, stop)
+                got = time.perf_counter()
+                if entry is _DONE:
+                    break
+
+                seq, item = entry
+                depth = in_queue.qsize()
+                if item is not _SKIP:
+                    item = stage.func(item)
+                    if item is None:
+                        item = _SKIP
+                done = time.perf_counter()
+                blocked = self._put(out_queue, (seq, item), stop)
+                stats.add(done - got, got - start, blocked, depth)
+        except Exception as e:
+            logger.error(f"Error in pipeline stage {stage.name}: {str(e)}")
+            errors.append(e)
+            stop.set()
+        finally:
+            # The last worker of a stage to finish closes the next queue
+            with remaining['lock']:
+                remaining['count'] -= 1
+                last = remaining['count'] == 0
+            if last:
+                for _ in range(downstream_workers):
+                    self._put(out_queue, _DONE, stop)
+
+    def run(self, source):
+        """Yield the results of the last stage for each item of `source`"""
+        stop = threading.Event()
+        errors = []
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        self._stats = {self.source_name: _StageStats(1)}
+        threads = []
+
+        downstream = self.stages[0].workers if self.stages else 1
+        threads.append(threading.Thread(
+            target=self._feed,
+            args=(source, queues[0], downstream, self._stats[self.source_name], stop, errors),
+            name=f"pipeline-{self.source_name}", daemon=True
+        ))
+        for index, stage in enumerate(self.stages):
+            stats = self._stats[stage.name] = _StageStats(stage.workers)
+            downstream = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            remaining = {'count': stage.workers, 'lock': threading.Lock()}
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[index], queues[index + 1], downstream, remaining, stats, stop, errors),
+                    name=f"pipeline-{stage.name}-{worker}", daemon=True
+                ))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        pending = {}
+        next_seq = 0
+        try:
+            while True:
+                entry = self._get(queues[-1], stop)
+                if entry is _DONE:
+                    break
+                seq, item = entry
+                if not self.ordered:
+                    if item is not _SKIP:
+                        yield item
+                    continue
+
+                # Hold back results that overtook earlier items on parallel
+                # stages; this is bounded by the number of items in flight
+                pending[seq] = item
+                while next_seq in pending:
+                    item = pending.pop(next_seq)
+                    next_seq += 1
+                    if item is not _SKIP:
+                        yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self._elapsed = time.perf_counter() - start
+
+        if errors:
+            raise errors[0]
+
+    def stats(self):
+        """Per-stage throughput and occupancy of the last run"""
+        return {name: stats.as_dict(self._elapsed) for name, stats in self._stats.items()}
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Where running jobs publish their progress, and the minimum time between
+# two snapshots of the same job
+PROGRESS_DIR = os.getenv('PROGRESS_DIR', os.path.join('cache', 'progress'))
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', '0.25'))
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class ProgressStore:
+    """Latest progress snapshot and emitted crops of every job.
+
+    Snapshots are small JSON files replaced atomically and crops are
+    appended to a JSON lines file, so the web app can follow jobs running
+    in other processes (or on Celery workers sharing the directory) and
+    read only the crops it has not seen yet. The process publishing a job
+    also keeps it in memory and answers from there.
+    """
+
+    def __init__(self, root=PROGRESS_DIR):
+        self.root = root
+        self._snapshots = {}
+        self._crops = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, job_id, suffix):
+        # Job IDs come from the browser; keep them inside the directory
+        return os.path.join(self.root, f"{os.path.basename(str(job_id))}{suffix}")
+
+    def publish(self, job_id, snapshot, crops=()):
+        """Record a job's snapshot and append newly emitted crop records"""
+        crops = list(crops)
+        with self._lock:
+            self._snapshots[job_id] = snapshot
+            self._crops.setdefault(job_id, []).extend(crops)
+        if crops:
+            with open(self._path(job_id, '.crops.jsonl'), 'a') as f:
+                f.write(''.join(json.dumps(crop) + '\n' for crop in crops))
+        path = self._path(job_id, '.json')
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def get(self, job_id):
+        """The latest snapshot of a job, or None if it has not published one"""
+        with self._lock:
+            if job_id in self._snapshots:
+                return self._snapshots[job_id]
+        try:
+            with open(self._path(job_id, '.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def crops(self, job_id, start=0):
+        """Crop records a job has emitted, from the `start`-th on"""
+        with self._lock:
+            if job_id in self._crops:
+                return self._crops[job_id][start:]
+        try:
+            with open(self._path(job_id, '.crops.jsonl'), 'r') as f:
+                lines = f.readlines()
+        except OSError:
+            return []
+        # A line still being appended by the publisher is left for the next read
+        return [json.loads(line) for line in lines[start:] if line.endswith('\n')]
+
+    def clear(self, job_id):
+        """Drop the crops of an earlier, interrupted run of a job"""
+        with self._lock:
+            self._crops[job_id] = []
+        path = self._path(job_id, '.crops.jsonl')
+        if os.path.exists(path):
+            os.remove(path)
+
+    def request_cancel(self, job_id):
+        """Ask a running job to stop, wherever it runs"""
+        open(self._path(job_id, '.cancel'), 'a').close()
+
+    def cancel_requested(self, job_id):
+        return os.path.exists(self._path(job_id, '.cancel'))
+
+    def forget(self, job_id):
+        """Drop a finished job from memory, and its cancel request; its
+        other files stay for late readers"""
+        with self._lock:
+            self._snapshots.pop(job_id, None)
+            self._crops.pop(job_id, None)
+        cancel_path = self._path(job_id, '.cancel')
+        if os.path.exists(cancel_path):
+            os.remove(cancel_path)
+
+
+class Progress:
+    """Counters of one running extraction.
+
+    Updating them costs a few attribute assignments and a clock read, so
+    they can be bumped for every frame; a snapshot is published to the
+    store at most every `interval` seconds, and once more when finished.
+    """
+
+    def __init__(self, job_id, store=None, interval=PROGRESS_INTERVAL):
+        self.job_id = job_id
+        self.store = store or get_store()
+        self.interval = interval
+        self.total_frames = None
+        self.start_frame = 0
+        self.decoded_frames = 0
+        self.analyzed_frames = 0
+        self.crops = 0
+        self.state = RUNNING
+        self.error = None
+        self._started = time.monotonic()
+        self._published = 0.0
+        self._pending = []
+        self._published_paths = set()
+        self._pending_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def start(self, total_frames, start_frame=0):
+        """Begin reporting, from `start_frame` when resuming an interrupted
+        run. Its crops stay in the store, so readers keep their place, and
+        are not published again when reported once more"""
+        self.total_frames = total_frames or None
+        self.start_frame = start_frame
+        self.decoded_frames = start_frame
+        self._started = time.monotonic()
+        if start_frame:
+            self._published_paths = {crop.get('path') for crop in self.store.crops(self.job_id)}
+        else:
+            self._published_paths = set()
+            self.store.clear(self.job_id)
+        self._publish()
+
+    def frames(self, decoded, analyzed):
+        """Report the number of frames decoded and analyzed so far"""
+        self.decoded_frames = decoded
+        self.analyzed_frames = analyzed
+        if time.monotonic() - self._published >= self.interval:
+            self._publish()
+
+    def crop(self, record):
+        """Report an emitted crop by its JSON record"""
+        with self._pending_lock:
+            self.crops += 1
+            if record.get('path') not in self._published_paths:
+                self._pending.append(record)
+        if time.monotonic() - self._published >= self.interval:
+            self._publish()
+
+    def finish(self, error=None):
+        self.state = FAILED if error else DONE
+        self.error = error
+        self._publish(wait=True)
+        # Readers go to the files from now on
+        self.store.forget(self.job_id)
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self._started
+        fps = (self.decoded_frames - self.start_frame) / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.state == RUNNING and self.total_frames and fps > 0:
+            eta = max(0.0, (self.total_frames - self.decoded_frames) / fps)
+        return {
+            'state': self.state,
+            'error': self.error,
+            'total_frames': self.total_frames,
+            'decoded_frames': self.decoded_frames,
+            'analyzed_frames': self.analyzed_frames,
+            'crops': self.crops,
+            'elapsed': round(elapsed, 2),
+            'fps': round(fps, 2),
+            'eta': None if eta is None else round(eta, 1),
+            'percent': (round(100.0 * min(self.decoded_frames, self.total_frames) / self.total_frames, 1)
+                        if self.total_frames else None)
+        }
+
+    def _publish(self, wait=False):
+        # Frames and crops are reported from different pipeline threads;
+        # whoever finds the lock taken skips this snapshot
+        if not self._lock.acquire(blocking=wait):
+            return
+        try:
+            self._published = time.monotonic()
+            with self._pending_lock:
+                pending, self._pending = self._pending, []
+            self.store.publish(self.job_id, self.snapshot(), pending)
+        except Exception as e:
+            logger.error(f"Error publishing progress of job {self.job_id}: {str(e)}")
+        finally:
+            self._lock.release()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Process-wide progress store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ProgressStore()
+        return _store
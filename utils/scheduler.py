@@ -0,0 +1,130 @@
+import os
+import math
+import time
+import logging
+import threading
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# Cores and memory one extraction job keeps busy (pose model, decoding and
+# enhancement threads), and hard limits on top of what the machine allows
+JOB_CORES = float(os.getenv('JOB_CORES', '2'))
+JOB_MEMORY = int(os.getenv('JOB_MEMORY', str(1536 * 1024 * 1024)))
+MAX_RUNNING_JOBS = int(os.getenv('MAX_RUNNING_JOBS', '0'))
+MAX_QUEUED_JOBS = int(os.getenv('MAX_QUEUED_JOBS', '50'))
+MAX_QUEUED_PER_USER = int(os.getenv('MAX_QUEUED_PER_USER', '5'))
+
+# A queued job gains one priority level for every this many seconds it waits
+JOB_AGING_SECONDS = float(os.getenv('JOB_AGING_SECONDS', '600'))
+
+# Database holding models.database.User, used to look up admins
+DATABASE_URL = os.getenv('DATABASE_URL')
+
+LOW = 0
+NORMAL = 1
+HIGH = 2
+
+
+class QueueFull(RuntimeError):
+    """Raised when a job is refused because the queue is too deep"""
+
+
+class Scheduler:
+    """Decides how many jobs run at once and which queued job runs next.
+
+    Concurrency follows the machine: one job per `job_cores` physical
+    cores, and no more than the available memory can hold at `job_memory`
+    bytes per job. The next job is the one with the highest priority,
+    raised as it ages; among equals the user with the fewest running jobs
+    goes first, then the user served least recently, so that users take
+    turns, then the oldest job. New jobs are refused once the queue, or a
+    user's share of it, is full.
+    """
+
+    def __init__(self, job_cores=JOB_CORES, job_memory=JOB_MEMORY, max_running=MAX_RUNNING_JOBS,
+                 max_queued=MAX_QUEUED_JOBS, max_queued_per_user=MAX_QUEUED_PER_USER,
+                 aging_seconds=JOB_AGING_SECONDS):
+        self.job_cores = job_cores
+        self.job_memory = job_memory
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.aging_seconds = aging_seconds
+
+    def max_capacity(self):
+        """Jobs the cores allow, whatever the memory"""
+        cores = psutil.cpu_count(logical=False) or psutil.cpu_count() or 1
+        slots = max(1, int(cores // self.job_cores))
+        if self.max_running:
+            slots = min(slots, self.max_running)
+        return slots
+
+    def capacity(self, running=0):
+        """Jobs that may run now, given `running` jobs already hold memory"""
+        by_memory = running + int(psutil.virtual_memory().available // self.job_memory)
+        return max(1, min(self.max_capacity(), by_memory))
+
+    def admit(self, user_id, queued, queued_by_user):
+        """Raise QueueFull unless a job of `user_id` may join the queue"""
+        if self.max_queued and queued >= self.max_queued:
+            raise QueueFull(f"{queued} jobs are already waiting, try again later")
+        if self.max_queued_per_user and queued_by_user >= self.max_queued_per_user:
+            raise QueueFull(f"You already have {queued_by_user} jobs waiting")
+
+    def pick(self, queued, running_by_user, last_started_by_user=None, now=None):
+        """Choose the next job among `queued`, dicts with user_id, priority
+        and created_at, given the number of running jobs of every user and
+        when each user's last job started"""
+        if not queued:
+            return None
+        now = time.time() if now is None else now
+        last_started_by_user = last_started_by_user or {}
+
+        def rank(job):
+            priority = job['priority']
+            if self.aging_seconds:
+                priority += (now - job['created_at']) // self.aging_seconds
+            user = job['user_id']
+            return (-priority, running_by_user.get(user, 0), last_started_by_user.get(user) or 0.0,
+                    job['created_at'])
+
+        return min(queued, key=rank)
+
+
+_sessions = None
+_sessions_lock = threading.Lock()
+
+
+def user_priority(user_id):
+    """HIGH for admins per models.database.User, NORMAL for everyone else
+    and whenever no DATABASE_URL is configured"""
+    global _sessions
+    if user_id is None or not DATABASE_URL:
+        return NORMAL
+    try:
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from models.database import User
+
+        with _sessions_lock:
+            if _sessions is None:
+                _sessions = sessionmaker(bind=create_engine(DATABASE_URL))
+        session = _sessions()
+        try:
+            user = session.get(User, int(user_id))
+        finally:
+            session.close()
+    except Exception as e:
+        logger.error(f"Error looking up user {user_id}: {str(e)}")
+        return NORMAL
+    return HIGH if user is not None and user.is_admin else NORMAL
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers, None when empty"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(q / 100.0 * len(values)) - 1))
+    return values[index]
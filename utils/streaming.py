@@ -0,0 +1,136 @@
+import os
+import re
+import mimetypes
+import logging
+from email.utils import formatdate, parsedate_to_datetime
+from flask import Response, request
+
+logger = logging.getLogger(__name__)
+
+# How long browsers may reuse a video without revalidating it
+VIDEO_MAX_AGE = int(os.getenv('VIDEO_MAX_AGE', '3600'))
+
+# Bytes read per block when the server cannot send the file itself
+_BLOCK_SIZE = 256 * 1024
+
+_RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def _etag(stat):
+    # Changes whenever the file is replaced or rewritten
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _parse_range(header, size):
+    """(start, end) of a single byte range, inclusive, None for a header
+    that is absent or not understood, which serves the whole file, or
+    False for a valid range outside the file"""
+    match = _RANGE.match(header.strip()) if header else None
+    if match is None or not any(match.groups()):
+        # Several ranges are answered with the whole file, as RFC 9110 allows
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last `last` bytes, of which an empty file has none
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        # Not a valid range at all (RFC 9110 14.1.1), so it is ignored
+        return None
+    if start >= size:
+        return False
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def _not_modified(etag, mtime):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag.strip('"'))
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _range_applies(etag, last_modified):
+    """Whether the If-Range validator, if any, still matches the file"""
+    if_range = request.headers.get('If-Range')
+    return not if_range or if_range in (etag, last_modified)
+
+
+def _file_body(path, start, length, size):
+    """Response body of `length` bytes of a file from `start`.
+
+    A range reaching the end of the file is handed to the server's
+    wsgi.file_wrapper positioned at `start`, which gunicorn sends with
+    sendfile(2) from the file's current offset, without copying it through
+    Python. Servers may send a wrapped file to its end, so shorter ranges,
+    and servers without a file wrapper, get a generator reading blocks.
+    """
+    f = open(path, 'rb')
+    f.seek(start)
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None and start + length == size:
+        return file_wrapper(f, _BLOCK_SIZE)
+
+    def blocks():
+        try:
+            remaining = length
+            while remaining > 0:
+                block = f.read(min(_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+        finally:
+            f.close()
+
+    return blocks()
+
+
+def send_video(path):
+    """Response streaming a video file, honouring byte ranges (so players
+    can seek without downloading what comes before) and conditional
+    requests on its ETag and Last-Modified date"""
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = _etag(stat)
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Cache-Control': f'private, max-age={VIDEO_MAX_AGE}'
+    }
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    if _not_modified(etag, stat.st_mtime):
+        return Response(status=304, headers=headers)
+
+    byte_range = None
+    if _range_applies(etag, last_modified):
+        byte_range = _parse_range(request.headers.get('Range'), size)
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+
+    status = 200
+    start, end = 0, size - 1
+    if byte_range is not None:
+        status = 206
+        start, end = byte_range
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    length = end - start + 1
+    headers['Content-Length'] = str(length)
+
+    if request.method == 'HEAD' or length == 0:
+        return Response(status=status, headers=headers, mimetype=mimetype)
+    logger.debug(f"Streaming bytes {start}-{end} of {path}")
+    return Response(_file_body(path, start, length, size), status=status, headers=headers,
+                    mimetype=mimetype, direct_passthrough=True)
@@ -0,0 +1,216 @@
+import os
+import time
+import threading
+import logging
+import cv2
+import numpy as np
+from utils.tiling import upscale
+
+logger = logging.getLogger(__name__)
+
+# Engine used when none is named, and the network settings for 'espcn'
+SR_ENGINE = os.getenv('SR_ENGINE', 'lanczos')
+SR_WEIGHTS = os.getenv('SR_WEIGHTS')
+SR_THREADS = int(os.getenv('SR_THREADS', '0'))
+SR_TILE = int(os.getenv('SR_TILE', '128'))
+SR_TILE_BATCH = int(os.getenv('SR_TILE_BATCH', '8'))
+
+# Sharpening applied after interpolation by the 'lanczos' engine
+_SHARPEN_KERNEL = np.array([[-1, -1, -1],
+                            [-1, 9, -1],
+                            [-1, -1, -1]], dtype=np.float32)
+
+
+class SREngine:
+    """Upscales BGR uint8 images by `scale` and keeps throughput counters"""
+
+    name = None
+    scale = 2
+
+    def __init__(self):
+        self.megapixels = 0.0
+        self.seconds = 0.0
+        self.images = 0
+        self._lock = threading.Lock()
+
+    def _upscale_batch(self, images):
+        raise NotImplementedError
+
+    def upscale(self, image):
+        return self.upscale_batch([image])[0]
+
+    def upscale_batch(self, images):
+        """Upscale several images at once; returns them in the same order"""
+        if not images:
+            return []
+        start = time.perf_counter()
+        outputs = self._upscale_batch(images)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.images += len(images)
+            self.megapixels += sum(out.shape[0] * out.shape[1] for out in outputs) / 1e6
+            self.seconds += elapsed
+        return outputs
+
+    def stats(self):
+        """Output megapixels produced per second of upscaling"""
+        with self._lock:
+            return {
+                'engine': self.name,
+                'images': self.images,
+                'megapixels': round(self.megapixels, 3),
+                'seconds': round(self.seconds, 3),
+                'mp_per_s': round(self.megapixels / self.seconds, 3) if self.seconds else None
+            }
+
+
+class LanczosEngine(SREngine):
+    """Lanczos interpolation followed by a 3x3 sharpen kernel"""
+
+    name = 'lanczos'
+
+    def _upscale_batch(self, images):
+        # Tiled so that large crops never hold a second full-size image
+        return [upscale(image, self.scale, cv2.INTER_LANCZOS4, _SHARPEN_KERNEL) for image in images]
+
+
+class BicubicEngine(SREngine):
+    """Plain bicubic interpolation"""
+
+    name = 'bicubic'
+
+    def _upscale_batch(self, images):
+        return [upscale(image, self.scale, cv2.INTER_CUBIC) for image in images]
+
+
+def _build_espcn(scale, channels=3):
+    """ESPCN-style network predicting a residual over bicubic upsampling.
+    The last layer starts at zero, so without trained weights the output
+    is exactly bicubic."""
+    import torch
+    from torch import nn
+    import torch.nn.functional as F
+
+    class ESPCN(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.features = nn.Sequential(
+                nn.Conv2d(channels, 64, 5, padding=2),
+                nn.Tanh(),
+                nn.Conv2d(64, 32, 3, padding=1),
+                nn.Tanh(),
+                nn.Conv2d(32, channels * scale * scale, 3, padding=1)
+            )
+            self.shuffle = nn.PixelShuffle(scale)
+            nn.init.zeros_(self.features[-1].weight)
+            nn.init.zeros_(self.features[-1].bias)
+
+        def forward(self, x):
+            base = F.interpolate(x, scale_factor=scale, mode='bicubic', align_corners=False)
+            return base + self.shuffle(self.features(x))
+
+    return ESPCN()
+
+
+class ESPCNEngine(SREngine):
+    """Small convolutional super-resolution network run on CPU in tiles.
+
+    Images are cut into `tile` x `tile` pixel tiles that overlap by
+    `overlap` pixels on every side, more than the network's receptive field
+    radius, so seams do not show once the overlap is cropped away. Tiles
+    from all images of a batch are pushed through the network `tile_batch`
+    at a time, which bounds memory regardless of crop size. Trained
+    weights are loaded from `weights` (a state_dict saved with torch.save);
+    none ship with the project, and without them the network only
+    reproduces bicubic interpolation, so they are required.
+    """
+
+    name = 'espcn'
+    # Radius of the 5x5 + 3x3 + 3x3 receptive field is 4; keep a margin
+    overlap = 8
+
+    def __init__(self, weights=SR_WEIGHTS, threads=SR_THREADS, tile=SR_TILE, tile_batch=SR_TILE_BATCH):
+        super().__init__()
+        import torch
+
+        self.torch = torch
+        if threads:
+            # Applies to the whole process; torch has no per-module setting
+            torch.set_num_threads(threads)
+        if not weights:
+            raise ValueError("The 'espcn' engine needs trained weights, set SR_WEIGHTS")
+        self.tile = tile
+        self.tile_batch = max(1, tile_batch)
+        self.model = _build_espcn(self.scale)
+        self.model.load_state_dict(torch.load(weights, map_location='cpu'))
+        logger.info(f"Loaded super-resolution weights from {weights}")
+        self.model.eval()
+
+    def _tiles(self, image):
+        """Yield (y, x, padded tile) covering the image"""
+        pad = self.overlap
+        h, w = image.shape[:2]
+        # Pad every tile to the same size so tiles of any image stack together
+        padded = cv2.copyMakeBorder(image, pad, pad + self.tile, pad, pad + self.tile, cv2.BORDER_REFLECT_101)
+        size = self.tile + 2 * pad
+        for y in range(0, h, self.tile):
+            for x in range(0, w, self.tile):
+                yield y, x, padded[y:y + size, x:x + size]
+
+    def _run(self, tiles):
+        torch = self.torch
+        batch = np.stack(tiles).astype(np.float32) / 255.0
+        with torch.inference_mode():
+            tensor = torch.from_numpy(batch).permute(0, 3, 1, 2).contiguous()
+            result = self.model(tensor).clamp_(0.0, 1.0).mul_(255.0).round_()
+        return result.permute(0, 2, 3, 1).to(torch.uint8).numpy()
+
+    def _upscale_batch(self, images):
+        s, pad = self.scale, self.overlap
+        outputs = [np.empty((img.shape[0] * s, img.shape[1] * s, 3), dtype=np.uint8) for img in images]
+
+        def flush(pending):
+            results = self._run([tile for _, _, _, tile in pending])
+            for (index, y, x, _), result in zip(pending, results):
+                out = outputs[index]
+                th = min(self.tile, images[index].shape[0] - y) * s
+                tw = min(self.tile, images[index].shape[1] - x) * s
+                out[y * s:y * s + th, x * s:x * s + tw] = result[pad * s:pad * s + th, pad * s:pad * s + tw]
+
+        pending = []
+        for index, image in enumerate(images):
+            for y, x, tile in self._tiles(image):
+                pending.append((index, y, x, tile))
+                if len(pending) == self.tile_batch:
+                    flush(pending)
+                    pending = []
+        if pending:
+            flush(pending)
+        return outputs
+
+
+ENGINES = {
+    'lanczos': LanczosEngine,
+    'bicubic': BicubicEngine,
+    'espcn': ESPCNEngine
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(name=None):
+    """Return the process-wide engine called `name` (SR_ENGINE by default);
+    'espcn' without SR_WEIGHTS gets the 'bicubic' engine"""
+    name = name or SR_ENGINE
+    if name not in ENGINES:
+        raise ValueError(f"Unknown super-resolution engine: {name}")
+    with _engines_lock:
+        if name not in _engines:
+            if name == 'espcn' and not SR_WEIGHTS:
+                # Untrained, the network would only cost more than bicubic
+                logger.error("No SR_WEIGHTS configured for the 'espcn' engine, using 'bicubic' instead")
+                _engines[name] = _engines.setdefault('bicubic', BicubicEngine())
+            else:
+                _engines[name] = ENGINES[name]()
+        return _engines[name]
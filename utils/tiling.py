@@ -0,0 +1,144 @@
+import os
+import logging
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Working memory one crop may use for intermediate images, on top of its
+# input and the output it is written into
+TILE_MEMORY_BUDGET = int(os.getenv('TILE_MEMORY_BUDGET', str(64 * 1024 * 1024)))
+
+# Rows of context each operation reads beyond a strip: Lanczos reads 4
+# source rows on either side, the 3x3 sharpen one more, the sigma 3
+# Gaussian of unsharp masking 9 and the 9 pixel bilateral filter 4
+UPSCALE_HALO = 5
+UNSHARP_HALO = 9
+TONE_MAP_HALO = 4
+
+# Fewer rows than this per strip spend more time on halos than on output
+MIN_STRIP_ROWS = 16
+
+
+class Workspace:
+    """Scratch arrays reused by every strip of a tiled operation.
+
+    A buffer is allocated on first use, for the largest strip, and later
+    strips get a view of its first rows.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        size = int(np.prod(shape))
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(size, dtype=dtype)
+        return buffer[:size].reshape(shape)
+
+
+def strip_rows(width, bytes_per_pixel, halo, budget=None):
+    """Rows per strip that keep a strip's working memory within `budget`"""
+    budget = TILE_MEMORY_BUDGET if budget is None else budget
+    rows = budget // max(1, width * bytes_per_pixel) - 2 * halo
+    if rows < MIN_STRIP_ROWS:
+        logger.debug(f"Memory budget of {budget} bytes is too small for {width} pixel wide strips")
+        return MIN_STRIP_ROWS
+    return rows
+
+
+def map_strips(image, func, halo, bytes_per_pixel, scale=1, out=None, budget=None):
+    """Run `func(strip, workspace)` over horizontal strips of an image.
+
+    Each strip is passed with `halo` extra rows above and below, so filters
+    see the same neighbourhood as on the whole image, and `func` returns it
+    `scale` times larger. Only the rows belonging to the strip are copied
+    into `out`, which is allocated when not given. `bytes_per_pixel` is the
+    working memory `func` needs per input pixel. Images that fit the budget
+    whole are processed in one call.
+    """
+    h, w = image.shape[:2]
+    rows = strip_rows(w, bytes_per_pixel, halo, budget)
+    workspace = Workspace()
+    if rows >= h:
+        result = func(image, workspace)
+        if out is None:
+            return result
+        np.copyto(out, result)
+        return out
+
+    if out is None:
+        out = np.empty((h * scale, w * scale) + image.shape[2:], dtype=image.dtype)
+    for y0 in range(0, h, rows):
+        y1 = min(h, y0 + rows)
+        top, bottom = max(0, y0 - halo), min(h, y1 + halo)
+        result = func(image[top:bottom], workspace)
+        out[y0 * scale:y1 * scale] = result[(y0 - top) * scale:(y1 - top) * scale]
+    return out
+
+
+def upscale(image, factor, interpolation=cv2.INTER_LANCZOS4, kernel=None, out=None, budget=None):
+    """Resize by an integer `factor` and optionally convolve with `kernel`,
+    without holding more than one strip of the intermediate images"""
+    h, w = image.shape[:2]
+    channels = image.shape[2] if image.ndim == 3 else 1
+
+    def run(strip, workspace):
+        shape = (strip.shape[0] * factor, w * factor) + image.shape[2:]
+        upscaled = cv2.resize(strip, shape[1::-1], dst=workspace.get('upscaled', shape, image.dtype),
+                              interpolation=interpolation)
+        if kernel is None:
+            return upscaled
+        return cv2.filter2D(upscaled, -1, kernel, dst=workspace.get('filtered', shape, image.dtype))
+
+    buffers = 1 if kernel is None else 2
+    return map_strips(image, run, UPSCALE_HALO, buffers * factor * factor * channels * image.itemsize,
+                      scale=factor, out=out, budget=budget)
+
+
+def unsharp(image, amount=1.5, sigma=3, out=None, budget=None):
+    """Unsharp masking: `amount` times the image minus a Gaussian blur"""
+    channels = image.shape[2] if image.ndim == 3 else 1
+
+    def run(strip, workspace):
+        blurred = cv2.GaussianBlur(strip, (0, 0), sigma, dst=workspace.get('blurred', strip.shape, strip.dtype))
+        return cv2.addWeighted(strip, amount, blurred, 1.0 - amount, 0,
+                               dst=workspace.get('sharpened', strip.shape, strip.dtype))
+
+    return map_strips(image, run, UNSHARP_HALO, 2 * channels * image.itemsize, out=out, budget=budget)
+
+
+def tone_map(image, channel_order='bgr', out=None, budget=None):
+    """Local tone mapping of the luminance of a uint8 image, raising the
+    contrast of a bilateral base layer while keeping the detail on top"""
+    to_lab, from_lab = ((cv2.COLOR_BGR2LAB, cv2.COLOR_LAB2BGR) if channel_order == 'bgr'
+                        else (cv2.COLOR_RGB2LAB, cv2.COLOR_LAB2RGB))
+
+    def run(strip, workspace):
+        shape = strip.shape
+        # Luminance of the float image
+        img_float = np.divide(strip, 255.0, out=workspace.get('float', shape, np.float32), dtype=np.float32)
+        lab_float = cv2.cvtColor(img_float, to_lab, dst=workspace.get('lab_float', shape, np.float32))
+        luminance = workspace.get('luminance', shape[:2], np.float32)
+        np.copyto(luminance, lab_float[:, :, 0])
+
+        # Enhance the contrast of the base layer and add the detail back,
+        # in place to keep the number of float planes down
+        base = cv2.bilateralFilter(luminance, 9, 0.1, 7, dst=workspace.get('base', shape[:2], np.float32))
+        detail = np.subtract(luminance, base, out=luminance)
+        enhanced = base
+        enhanced -= 0.5
+        enhanced *= 1.2
+        enhanced += 0.5
+        np.clip(enhanced, 0, 1, out=enhanced)
+        enhanced += detail
+        enhanced *= 255
+
+        # Replace the L channel of the 8-bit Lab image
+        lab = cv2.cvtColor(strip, to_lab, dst=workspace.get('lab', shape, np.uint8))
+        lab[:, :, 0] = enhanced.astype(np.uint8)
+        return cv2.cvtColor(lab, from_lab, dst=workspace.get('toned', shape, np.uint8))
+
+    # Two float32 images, three float32 planes and two uint8 images
+    return map_strips(image, run, TONE_MAP_HALO, 2 * 12 + 3 * 4 + 2 * 3, out=out, budget=budget)
@@ -0,0 +1,102 @@
+def box_iou(a, b):
+    """Intersection over union of two (x_min, y_min, x_max, y_max) boxes"""
+    x_min, y_min = max(a[0], b[0]), max(a[1], b[1])
+    x_max, y_max = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x_max - x_min) * max(0, y_max - y_min)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 0.0
+
+
+class PersonTracker:
+    """Follow one person across sampled frames.
+
+    While a track is alive, detection only needs to look at the region of
+    interest around the person's landmarks, grown by `expand` of their
+    extent on every side. The region stays put while the landmarks remain
+    inside it and is moved when they come within `margin` of its edge, so
+    a pose model can track landmarks within it; `roi_started` is set when
+    a track gets its first region, for that model to start afresh. A track is lost after `max_misses` frames
+    without a detection; a new detection whose crop box overlaps the old
+    one by less than `min_iou` starts a new track.
+    """
+
+    # Once the ROI covers this share of the frame there is nothing to save
+    MAX_ROI_SHARE = 0.8
+
+    def __init__(self, expand=0.25, margin=0.05, max_misses=2, min_iou=0.3):
+        self.expand = expand
+        self.margin = margin
+        self.max_misses = max_misses
+        self.min_iou = min_iou
+        self.bbox = None
+        self.extent = None
+        self.region = None
+        self.roi_started = False
+        self.track_id = None
+        self.misses = 0
+        self.next_id = 1
+        self.roi_detections = 0
+        self.full_detections = 0
+        self.roi_moves = 0
+        self.lost_tracks = 0
+
+    def _inside(self, extent, region):
+        mx = int((extent[2] - extent[0]) * self.margin)
+        my = int((extent[3] - extent[1]) * self.margin)
+        return (extent[0] - mx >= region[0] and extent[1] - my >= region[1] and
+                extent[2] + mx <= region[2] and extent[3] + my <= region[3])
+
+    def roi(self, frame_shape):
+        """Region to run detection on, or None for the full frame"""
+        if self.extent is None:
+            self.region = None
+            return None
+        if self.region is not None and self._inside(self.extent, self.region):
+            return self.region
+
+        h, w = frame_shape[:2]
+        x_min, y_min, x_max, y_max = self.extent
+        dx = int((x_max - x_min) * self.expand)
+        dy = int((y_max - y_min) * self.expand)
+        roi = (max(0, x_min - dx), max(0, y_min - dy), min(w, x_max + dx), min(h, y_max + dy))
+        if (roi[2] - roi[0]) * (roi[3] - roi[1]) > self.MAX_ROI_SHARE * w * h:
+            self.region = None
+            return None
+        if self.region is None:
+            self.roi_started = True
+        else:
+            self.roi_moves += 1
+        self.region = roi
+        return roi
+
+    def update(self, bbox, extent=None):
+        """Feed the detection of the current frame, its crop box and the
+        extent of its landmarks (None when nothing was found), and return
+        its track ID"""
+        if bbox is None:
+            self.misses += 1
+            if self.bbox is not None and self.misses >= self.max_misses:
+                self.bbox = None
+                self.extent = None
+                self.track_id = None
+                self.lost_tracks += 1
+            return None
+
+        if self.bbox is None or box_iou(bbox, self.bbox) < self.min_iou:
+            self.track_id = self.next_id
+            self.next_id += 1
+            # A new person; do not track them from the last one's region
+            self.region = None
+        self.bbox = bbox
+        self.extent = extent
+        self.misses = 0
+        return self.track_id
+
+    def stats(self):
+        return {
+            'tracks': self.next_id - 1,
+            'lost_tracks': self.lost_tracks,
+            'roi_detections': self.roi_detections,
+            'full_detections': self.full_detections,
+            'roi_moves': self.roi_moves
+        }
@@ -0,0 +1,257 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+# Where uploaded videos end up; uploads in progress are kept in a hidden
+# directory inside it, so finishing one is a rename on the same filesystem
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', 'uploads')
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', str(20 * 1024 ** 3)))
+# Largest chunk one request may carry; the browser sends 8 MB chunks
+MAX_CHUNK_SIZE = int(os.getenv('MAX_CHUNK_SIZE', str(64 * 1024 * 1024)))
+# Unfinished uploads older than this are deleted
+UPLOAD_EXPIRY_SECONDS = float(os.getenv('UPLOAD_EXPIRY_SECONDS', str(24 * 3600)))
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+
+# Bytes read from the request and written to disk at a time
+_BUFFER_SIZE = 1024 * 1024
+
+_UPLOAD_ID = re.compile(r'[0-9a-f]{32}')
+
+
+class UploadError(ValueError):
+    """Raised for an upload request that cannot be served, with the HTTP
+    status to answer it with"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class UploadStore:
+    """Resumable uploads streamed to disk chunk by chunk.
+
+    create() announces a file and its size, append() adds the bytes sent
+    at the upload's current offset, which status() reports so that an
+    interrupted upload continues where it stopped. Chunks are copied from
+    the request to the partial file a buffer at a time and a SHA-256 of the
+    file is updated as they arrive; when the last byte is in, the file is
+    checked against the checksum given to create(), if any, and renamed
+    into `root`. The hash of an upload resumed after a restart, or whose
+    previous chunk went to another process, is rebuilt from its partial
+    file. Chunks of one upload are serialised within a process; the
+    offset check keeps clients from interleaving them.
+    """
+
+    def __init__(self, root=UPLOAD_DIR):
+        self.root = root
+        self.partial_dir = os.path.join(root, '.partial')
+        self._hashes = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+    def _path(self, upload_id, suffix):
+        if not _UPLOAD_ID.fullmatch(str(upload_id)):
+            raise UploadError("Unknown upload", status=404)
+        return os.path.join(self.partial_dir, f"{upload_id}{suffix}")
+
+    def _load(self, upload_id):
+        try:
+            with open(self._path(upload_id, '.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise UploadError("Unknown upload", status=404)
+
+    def _save(self, upload_id, state):
+        path = self._path(upload_id, '.json')
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(state, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _forget(self, upload_id):
+        """Drop the hash and lock of an upload that is finished or gone"""
+        with self._lock:
+            self._hashes.pop(upload_id, None)
+            self._locks.pop(upload_id, None)
+
+    def create(self, filename, size, sha256=None):
+        """Start an upload of `size` bytes and return its status"""
+        filename = secure_filename(filename or '')
+        if not filename.lower().endswith(VIDEO_EXTENSIONS):
+            raise UploadError(f"Only {', '.join(VIDEO_EXTENSIONS)} videos can be uploaded")
+        if not isinstance(size, int) or size < 0:
+            raise UploadError("The upload size is required")
+        if size > MAX_UPLOAD_SIZE:
+            raise UploadError(f"Videos are limited to {MAX_UPLOAD_SIZE} bytes", status=413)
+        self.expire()
+
+        upload_id = uuid.uuid4().hex
+        state = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': size,
+            'expected_sha256': sha256.lower() if sha256 else None,
+            'created_at': time.time(),
+            'path': None,
+            'sha256': None
+        }
+        open(self._path(upload_id, '.part'), 'wb').close()
+        self._save(upload_id, state)
+        logger.info(f"Started upload {upload_id} of {filename} ({size} bytes)")
+        if size == 0:
+            with self._upload_lock(upload_id):
+                return self._complete(upload_id, state, hashlib.sha256())
+        return self.status(upload_id)
+
+    def status(self, upload_id):
+        """Filename, size and offset of an upload, and once complete the
+        path of the video and its SHA-256"""
+        state = self._load(upload_id)
+        if state['path'] is not None:
+            offset = state['size']
+        else:
+            offset = os.path.getsize(self._path(upload_id, '.part'))
+        return {
+            'upload_id': upload_id,
+            'filename': state['filename'],
+            'size': state['size'],
+            'offset': offset,
+            'complete': state['path'] is not None,
+            'sha256': state['sha256']
+        }
+
+    def path(self, upload_id):
+        """Where a completed upload is stored, or None"""
+        try:
+            return self._load(upload_id)['path']
+        except UploadError:
+            return None
+
+    def append(self, upload_id, offset, stream, length):
+        """Write `length` bytes read from `stream` at `offset` and return
+        the upload's status. A chunk for any other offset than the current
+        one is refused with the current offset, for the client to resume,
+        and so is a chunk for a completed upload, with its size"""
+        if length is None:
+            raise UploadError("Chunks need a Content-Length", status=411)
+        if length > MAX_CHUNK_SIZE:
+            raise UploadError(f"Chunks are limited to {MAX_CHUNK_SIZE} bytes", status=413)
+
+        with self._upload_lock(upload_id):
+            try:
+                state = self._load(upload_id)
+            except UploadError:
+                # Unknown or expired; keep no lock for it
+                self._forget(upload_id)
+                raise
+            if state['path'] is not None:
+                # A late or retried chunk, e.g. the last one whose answer was
+                # lost; the upload kept no lock once complete, keep none again
+                self._forget(upload_id)
+                raise UploadError("Upload is already complete", status=409, offset=state['size'])
+            part_path = self._path(upload_id, '.part')
+            current = os.path.getsize(part_path)
+            if offset != current:
+                raise UploadError(f"Upload is at offset {current}", status=409, offset=current)
+            if offset + length > state['size']:
+                raise UploadError("Chunk runs past the announced size", status=413)
+
+            # The hash kept from the last chunk is stale if another process
+            # took the chunks in between
+            hashed, sha = self._hashes.pop(upload_id, (None, None))
+            if hashed != offset:
+                sha = _hash_file(part_path)
+            received = 0
+            with open(part_path, 'ab') as f:
+                while received < length:
+                    block = stream.read(min(_BUFFER_SIZE, length - received))
+                    if not block:
+                        break
+                    f.write(block)
+                    sha.update(block)
+                    received += len(block)
+            # Bytes that did arrive from a dropped connection are kept; the
+            # client asks for the offset and sends the rest
+            if received < length:
+                logger.warning(f"Upload {upload_id} received {received} of {length} bytes")
+            self._hashes[upload_id] = (offset + received, sha)
+
+            if offset + received == state['size']:
+                return self._complete(upload_id, state, sha)
+        return self.status(upload_id)
+
+    def _complete(self, upload_id, state, sha):
+        """Check the received file and move it into place, with the upload's
+        lock held. The lock is only dropped once the final state is on disk,
+        so that a late chunk waits for it rather than racing the rename"""
+        digest = sha.hexdigest()
+        part_path = self._path(upload_id, '.part')
+        if state['expected_sha256'] and digest != state['expected_sha256']:
+            os.remove(part_path)
+            os.remove(self._path(upload_id, '.json'))
+            self._forget(upload_id)
+            raise UploadError("Checksum mismatch, upload the video again", status=422)
+
+        name, extension = os.path.splitext(state['filename'])
+        final_path = os.path.join(self.root, state['filename'])
+        if os.path.exists(final_path):
+            final_path = os.path.join(self.root, f"{name}_{upload_id[:8]}{extension}")
+        os.replace(part_path, final_path)
+        state.update(path=final_path, sha256=digest)
+        self._save(upload_id, state)
+        self._forget(upload_id)
+        logger.info(f"Completed upload {upload_id} to {final_path} (sha256 {digest})")
+        return self.status(upload_id)
+
+    def expire(self, now=None):
+        """Delete unfinished uploads older than UPLOAD_EXPIRY_SECONDS"""
+        now = time.time() if now is None else now
+        for name in os.listdir(self.partial_dir):
+            if not name.endswith('.json'):
+                continue
+            upload_id = name[:-len('.json')]
+            try:
+                state = self._load(upload_id)
+            except UploadError:
+                continue
+            if state['path'] is None and now - state['created_at'] > UPLOAD_EXPIRY_SECONDS:
+                logger.info(f"Removing expired upload {upload_id}")
+                for suffix in ('.part', '.json'):
+                    if os.path.exists(self._path(upload_id, suffix)):
+                        os.remove(self._path(upload_id, suffix))
+                self._forget(upload_id)
+
+
+def _hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_BUFFER_SIZE), b''):
+            sha.update(block)
+    return sha
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_uploads():
+    """Process-wide upload store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = UploadStore()
+        return _store